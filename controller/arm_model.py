@@ -1,26 +1,135 @@
 import numpy as np
-from visual_kinematics.RobotSerial import *
+from collections import OrderedDict, deque
+import config
+import kinematics
+import pose_checks
+from ik_table import IKTable
+from reachability import ReachabilityMap
 
 class ArmModel():
-    def __init__(self, x_limit, y_limit, z_limit):
-        # Using Denavit-Hartenberg (DH) notation for representation of arm's construction
-        # DH modelling file found in /DH/ArmDH.kinbin, used by "Robotic Arm Kinematic GUI - Part of MRPT"
-        #                      [d, a, alpha, theta]
-        dh_params = np.array([[17.0, 0., 90.0 * pi / 180, 0.],
-                          [0., 11.5, 0., 3 * pi / 180],
-                          [0., 11.0, 0., -90.0 * pi / 180]])
-
-        # Electro magnet tool DH is unused by the model as the joint self orientates down.
-        # It's height is factored into the target coordinates resulting in the target being reached
-        # with the tool directly above regardless of the orientation of the end frame.
-        # [0., 7.6, 0., 37 * pi / 180]
-
-        self.model = RobotSerial(
-            dh_params=dh_params,
-            plot_xlim=x_limit,
-            plot_ylim=y_limit,
-            plot_zlim=z_limit,
-            max_iter=1000)
+    def __init__(self, x_limit, y_limit, z_limit, solver=config.IK_SOLVER, joint_limits=config.JOINT_LIMITS):
+        self.x_limit = x_limit
+        self.y_limit = y_limit
+        self.z_limit = z_limit
+        # Using Denavit-Hartenberg (DH) notation for representation of arm's construction, see kinematics.py
+        self._dh_params = kinematics.DH_PARAMS
+        self.solver = solver
+        self.joint_limits = joint_limits
+
+        # LRU cache of solved targets keyed on coordinates quantised to config.IK_CACHE_RESOLUTION
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # Seeds for warm starting the iterative solver, see initial_guess
+        self.solved_targets = deque(maxlen=config.IK_WARM_START_HISTORY)
+        self.commanded_pose = None
+        # Iterations taken by each iterative solve, most recent last
+        self.iteration_counts = deque(maxlen=config.IK_ITERATION_HISTORY)
+
+        # Used to reject unreachable targets without solving them
+        self.reachability = ReachabilityMap.build(self._dh_params, joint_limits, config.REACHABILITY_RESOLUTION)
+
+        self.table = None
+        if solver == "table":
+            self.table = IKTable.load(config.IK_TABLE_PATH, self.dh_params, joint_limits)
+            if self.table is None:
+                print(f"[ArmModel] IK table {config.IK_TABLE_PATH} missing or out of date, run ik_table.py to rebuild it. Using analytic solver.")
+
+        # visual_kinematics model, only created when the iterative solver or plotting needs it
+        self._model = None
+        # Joint angles in radians of the last solved pose
+        self.pose = None
+
+
+    @property
+    def model(self):
+        """
+            The visual_kinematics model of the arm. Created on first use, importing
+            visual_kinematics loads matplotlib which slows down start up.
+        """
+        if self._model is None:
+            from iterative_model import CountingRobotSerial
+
+            # Electro magnet tool DH is unused by the model as the joint self orientates down.
+            # It's height is factored into the target coordinates resulting in the target being reached
+            # with the tool directly above regardless of the orientation of the end frame.
+            # [0., 7.6, 0., 37 * pi / 180]
+
+            self._model = CountingRobotSerial(
+                dh_params=np.array(self._dh_params),
+                plot_xlim=self.x_limit,
+                plot_ylim=self.y_limit,
+                plot_zlim=self.z_limit,
+                max_iter=1000)
+
+            if self.pose is not None:
+                self._model.forward(self.pose)
+
+        return self._model
+
+
+    def set_pose(self, pose):
+        """
+            Records the solved pose in radians, keeping the visual_kinematics model in the same
+            pose for plotting if it has been created.
+        """
+        self.pose = np.array(pose, dtype=np.float64)
+        if self._model is not None:
+            self._model.forward(self.pose)
+
+
+    def show(self, body=True, ws=False):
+        """
+            Plots the arm in the last solved pose, and optionally it's workspace.
+        """
+        self.model.show(body, ws)
+
+
+    @property
+    def dh_params(self):
+        return self._dh_params
+
+
+    @dh_params.setter
+    def dh_params(self, dh_params):
+        self._dh_params = dh_params
+
+        params = np.array(dh_params)
+        if self._model is not None:
+            self._model.params = params[:, 0:3]
+            self._model.initial_offset = params[:, 3]
+
+        # Solutions for the old arm model are no longer valid
+        self.clear_cache()
+        self.solved_targets.clear()
+        self.reachability = ReachabilityMap.build(dh_params, self.joint_limits, config.REACHABILITY_RESOLUTION)
+        if self.table is not None and not np.allclose(self.table.dh_params, params):
+            print("[ArmModel] IK table was built for different DH parameters, using analytic solver.")
+            self.table = None
+
+
+    def is_reachable(self, x, y, z) -> bool:
+        """
+            Quick check against the reachability map. False if the target definitely can't be
+            reached, True if it may be and calc_joint_degrees will decide.
+        """
+        return self.reachability.is_reachable(x, y, z)
+
+
+    def clear_cache(self):
+        self.cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+    def cache_info(self) -> dict:
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self.cache),
+            "max_size": config.IK_CACHE_SIZE
+        }
 
 
     def calc_joint_degrees(self, x, y, z, dec_places=1) -> list:
@@ -29,6 +138,9 @@ class ArmModel():
             end frame to reach the supplied coordinates. Returns best attempt if coordinates
             are unreachable.
 
+            Results are cached, targets are snapped to config.IK_CACHE_RESOLUTION so repeated
+            requests for the same spot, i.e. pickup retries, aren't solved again.
+
             Parameters
             ----------
             x: float
@@ -43,26 +155,195 @@ class ArmModel():
             angles: list 
                 List containing joint angels and if position reachable [bool, float, float, float]
         """
-        self.model.forward([self.determine_quadrant_angle(x,y), 0, 0])
+        if config.IK_CACHE_SIZE <= 0:
+            return self.solve_joint_degrees(x, y, z, dec_places)
+
+        resolution = config.IK_CACHE_RESOLUTION
+        key = (round(x / resolution), round(y / resolution), round(z / resolution), dec_places)
+
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(key)
+            self.set_pose(np.radians(result[1:]))
+            return list(result)
+
+        self.cache_misses += 1
+        result = self.solve_joint_degrees(key[0] * resolution, key[1] * resolution, key[2] * resolution, dec_places)
+
+        self.cache[key] = list(result)
+        if len(self.cache) > config.IK_CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return result
+
+
+    def solve_joint_degrees(self, x, y, z, dec_places=1) -> list:
+        """
+            Solves the target with the configured solver bypassing the cache, see calc_joint_degrees.
+        """
+        if not self.reachability.is_reachable(x, y, z):
+            # No solver can reach it, skip straight to the analytic best attempt
+            _, angles = kinematics.solve_analytic(x, y, z, self.dh_params, self.joint_limits, config.IK_ELBOW_UP)
+            self.set_pose(np.radians(angles))
+            return [False] + [round(angle, dec_places) for angle in angles]
+
+        if self.table is not None:
+            result = self.table.lookup(x, y, z)
+            if result is not None:
+                reachable, angles = result
+                self.set_pose(np.radians(angles))
+                return [reachable] + [round(angle, dec_places) for angle in angles]
+
+        # Targets outside of the table are solved directly
+        if self.solver in ("analytic", "table"):
+            reachable, angles = kinematics.solve_analytic(
+                x, y, z, self.dh_params, self.joint_limits, config.IK_ELBOW_UP)
+
+            if reachable or not config.IK_ITERATIVE_FALLBACK:
+                # Keep the visual_kinematics model in the solved pose for plotting
+                self.set_pose(np.radians(angles))
+                if reachable and kinematics.is_elbow_up(angles, self.dh_params) == config.IK_ELBOW_UP:
+                    self.solved_targets.append(((x, y, z), np.radians(angles)))
+                return [reachable] + [round(angle, dec_places) for angle in angles]
+
+        return self.calc_joint_degrees_iterative(x, y, z, dec_places)
+
+
+    def calc_joint_degrees_batch(self, points, dec_places=1) -> np.ndarray:
+        """
+            Solves many targets in one vectorised pass with the analytic solver, regardless of
+            the configured solver.
+
+            Parameters
+            ----------
+            points: np.ndarray
+                Targets as an array of shape (N, 3) of x, y, z coordinates.
+
+            Returns
+            -------
+            angles: np.ndarray
+                Structured array with shape (N,) of "reachable", "elbow_up", "base", "shoulder"
+                and "elbow" fields, see kinematics.SOLUTION_DTYPE.
+        """
+        solutions = kinematics.solve_analytic_batch(
+            points, self.dh_params, self.joint_limits, config.IK_ELBOW_UP)
+
+        for field in ("base", "shoulder", "elbow"):
+            solutions[field] = np.round(solutions[field], dec_places)
+        return solutions
+
+
+    def check_poses(self, joints) -> np.ndarray:
+        """
+            Checks many poses at once for joint limits, hitting the floor and blocking the camera.
+
+            Parameters
+            ----------
+            joints: np.ndarray
+                Poses as an array of shape (N, 3) of base, shoulder, elbow angles in degrees.
+
+            Returns
+            -------
+            checks: np.ndarray
+                Structured array with shape (N,) of "within_limits", "floor_clear", "view_clear"
+                and "safe" fields, see pose_checks.POSE_CHECK_DTYPE.
+        """
+        return pose_checks.check_poses(joints, self.dh_params, self.joint_limits)
+
+
+    def is_direct_path_clear(self, start, end) -> bool:
+        """
+            Checks if the arm can move straight from the start to the end pose in degrees without
+            going through the neutral pose, see pose_checks.is_direct_path_clear.
+            Always False if the start pose isn't known, i.e. before the first command.
+        """
+        if start is None:
+            return False
+        return pose_checks.is_direct_path_clear(start, end, self.dh_params)
+
+
+    def calc_joint_degrees_iterative(self, x, y, z, dec_places=1) -> list:
+        """
+            Same as calc_joint_degrees but always uses the iterative visual_kinematics solver,
+            seeded by initial_guess. A warm started solve which doesn't find a pose within the joint
+            limits is retried from the quadrant seed, as a seed on the other elbow branch can lead
+            the solver outside of them.
+        """
+        seed = self.initial_guess(x, y, z)
+        quadrant_seed = self.initial_guess(x, y, z, warm=False)
+        reachable, angles = self.solve_iterative(x, y, z, seed)
+        if not reachable and not np.array_equal(seed, quadrant_seed):
+            reachable, angles = self.solve_iterative(x, y, z, quadrant_seed)
+
+        # Only poses the solver should end up in are kept as seeds
+        if reachable and kinematics.is_elbow_up(angles, self.dh_params) == config.IK_ELBOW_UP:
+            self.solved_targets.append(((x, y, z), np.radians(angles)))
+
+        return [
+            reachable,
+            round(angles[0], dec_places),
+            round(angles[1], dec_places),
+            round(angles[2], dec_places)
+        ]
+
+
+    def solve_iterative(self, x, y, z, seed) -> tuple:
+        """
+            Runs the iterative solver from the seed in radians, returns (reachable, angles in degrees).
+            Reachable is False if it didn't converge or the pose is outside of the joint limits.
+        """
+        self.model.forward(seed)
 
         target_position = np.array([[x], [y], [z]])
         # a, b, c - degrees of rotation of the z, y, x axes from the base axes
         # default to 0 i.e tool always faces same as x in default position 
         target_tool_rotation = np.array([0., 0., 0.])
 
+        from iterative_model import Frame
         end = Frame.from_euler_3(target_tool_rotation, target_position)
         self.model.inverse(end)
+        self.iteration_counts.append(self.model.iterations)
 
         axis_values = self.model.axis_values
+        self.pose = np.copy(axis_values)
+
         base_rotation = rad_to_deg(axis_values[0])
         elbow_rotation = rad_to_deg(axis_values[1])
         wrist_rotation = rad_to_deg(axis_values[2])
-        return [
-            self.model.is_reachable_inverse, 
-            round(base_rotation, dec_places), 
-            round(elbow_rotation, dec_places), 
-            round(wrist_rotation, dec_places)
-        ]
+        angles = [base_rotation, elbow_rotation, wrist_rotation]
+        return self.model.is_reachable_inverse and kinematics.within_joint_limits(angles, self.joint_limits), angles
+
+
+    def set_commanded_pose(self, base, shoulder=None, elbow=None):
+        """
+            Records the joint angles in degrees last sent to the arm, used to warm start the
+            iterative solver and plan direct moves. None if the arm's pose isn't known, i.e. after
+            a move failed part way.
+        """
+        self.commanded_pose = None if base is None else [base, shoulder, elbow]
+
+
+    def initial_guess(self, x, y, z, warm=True) -> np.ndarray:
+        """
+            Joint angles in radians the iterative solver starts from, depending on config.IK_WARM_START.
+
+            "nearest" - The solution of the closest previously solved target, otherwise as "commanded".
+                Only solutions within the joint limits on the preferred elbow branch are kept.
+            "commanded" - The pose last sent to the arm, otherwise as "quadrant".
+            "quadrant" - The base facing the middle of the targets quadrant, always used if warm is False.
+        """
+        if not warm:
+            return np.radians([self.determine_quadrant_angle(x, y), 0, 0])
+
+        if config.IK_WARM_START == "nearest" and self.solved_targets:
+            targets = np.array([target for target, _ in self.solved_targets])
+            nearest = np.argmin(np.sum((targets - (x, y, z)) ** 2, axis=1))
+            return np.copy(self.solved_targets[nearest][1])
+
+        if config.IK_WARM_START in ("nearest", "commanded") and self.commanded_pose is not None:
+            return np.radians(self.commanded_pose)
+
+        return np.radians([self.determine_quadrant_angle(x, y), 0, 0])
 
     
     def determine_quadrant_angle(_self, x: float, y: float) -> float:
@@ -94,4 +375,4 @@ class ArmModel():
 
 
 def rad_to_deg(rad):
-    return (rad * 180) / pi
+    return (rad * 180) / np.pi
@@ -0,0 +1,227 @@
+import time
+# Taken before the other imports so the reported start up time includes loading them
+START_TIME = time.perf_counter()
+
+import asyncio, config
+import detection_channel
+from datetime import datetime, timezone
+from arm_model import ArmModel
+from async_serial_communication import AsyncSerialConnection
+from master import (read_objects, decide_target_objects_order, decide_target_objects_destination,
+                    plan_pickup_waypoints, set_measured_pose, VEX_TIMEOUT, CAMRULER_TIMEOUT, DROP_OFF_Z)
+
+# Seconds between checks of the object log for new detections
+OBJECT_POLL_INTERVAL = 0.1
+
+
+class ObjectWatcher():
+    """
+    Keeps the latest detected objects in the background while the arm is moving, waking anything
+    waiting for a newer set. Detections published on the channel are taken as they arrive,
+    otherwise the object log is polled every interval.
+    """
+    def __init__(self, interval=OBJECT_POLL_INTERVAL):
+        self.interval = interval
+        self.objects = []
+        self.changed = asyncio.Condition()
+
+
+    async def run(self):
+        if config.OBJECT_SOURCE == "channel":
+            await self.subscribe()
+            return
+
+        while True:
+            try:
+                objects = read_objects()
+            except (OSError, ValueError, KeyError) as ex:
+                # The log is rewritten from scratch so it can be caught half written
+                print(f"[Object Watcher] Could not read object log: {ex}")
+                objects = None
+
+            if objects is not None:
+                await self.update(objects)
+            await asyncio.sleep(self.interval)
+
+
+    async def subscribe(self):
+        loop = asyncio.get_running_loop()
+        subscriber = detection_channel.get_subscriber()
+        updated = asyncio.Event()
+        # Called on the subscriber's thread
+        listener = lambda snapshot: loop.call_soon_threadsafe(updated.set)
+
+        subscriber.add_listener(listener)
+        try:
+            while True:
+                await updated.wait()
+                updated.clear()
+                await self.update(read_objects())
+        finally:
+            subscriber.remove_listener(listener)
+
+
+    async def update(self, objects):
+        if objects != self.objects:
+            async with self.changed:
+                self.objects = objects
+                self.changed.notify_all()
+
+
+    async def wait_for_update(self, after: datetime, timeout: float) -> list:
+        """
+        Waits for objects detected after the timestamp, or an empty list of objects.
+        Raises TimeoutError if the camera doesn't update in time.
+        """
+        def is_updated():
+            return len(self.objects) == 0 or any(o.timestamp > after for o in self.objects)
+
+        async with asyncio.timeout(timeout):
+            async with self.changed:
+                await self.changed.wait_for(is_updated)
+                return self.objects
+
+
+async def pickup_object(arm, connection, watcher, object_x, object_y) -> str:
+    """
+    Picks up the object, retrying until the camera no longer sees it.
+    Returns "picked_up", "unreachable", "replan" if the link dropped and recovered or "lost_connection".
+    """
+    while True:
+        print("[Async Master] Calculating angles for pickup...")
+        joint_angles_pickup = arm.calc_joint_degrees(object_x, object_y, config.Z_AXIS_TOLERANCE)
+
+        if not joint_angles_pickup[0]:
+            print(f"[Async Master] Pickup position ({object_x}, {object_y}) is unreachable")
+            return "unreachable"
+
+        # Move arm to deadzone straight after the pickup to unblock view for camera, go to closest facing direction on the x axis
+        if abs(joint_angles_pickup[1]) >= 270 or abs(joint_angles_pickup[1]) <= 90:
+            park_angles = [0, 90, 0]
+        else:
+            park_angles = [180, 90, 0]
+
+        waypoints = plan_pickup_waypoints(arm, object_x, object_y, joint_angles_pickup[1:], park_angles)
+
+        print("[Async Master] Sending pickup sequence to VEX...")
+        is_done = await connection.move_sequence(
+            waypoints,
+            VEX_TIMEOUT * len(waypoints),
+            lambda index: print(f"[Async Master] VEX brain reached waypoint {index + 1} of {len(waypoints)}"))
+        if not is_done:
+            # The arm may have stopped anywhere
+            is_recovered = await recover_link(connection)
+            set_measured_pose(arm, connection)
+            if is_recovered:
+                return "replan"
+            print(f"[Async Master] Timed out while waiting for vex brain to respond, please check that the vex brain is operating correctly")
+            return "lost_connection"
+        arm.set_commanded_pose(*park_angles)
+        print(f"[Async Master] VEX brain responded in {connection.last_round_trip:.2f}s")
+
+        print("[Async Master] Waiting for object list update after movement...")
+        updated_objects = await watcher.wait_for_update(datetime.now(tz=timezone.utc), CAMRULER_TIMEOUT)
+
+        # Check for any object near target origin — assume pickup succeeded if none are near
+        if all(((o.mid_x - object_x) ** 2 + (o.mid_y - object_y) ** 2) ** 0.5 >= 10 for o in updated_objects):
+            print(f"[Async Master] No objects still near origin, pickup succeeded...")
+            return "picked_up"
+
+        print(f"[Async Master] Object still near origin, pickup failed...")
+
+
+async def recover_link(connection) -> bool:
+    """
+    Called when a command fails, waits for the link to come back if it went down. See master.recover_link.
+    """
+    if connection.is_link_up:
+        return False
+
+    print("[Async Master] Lost link to VEX brain, waiting for it to come back...")
+    if not await connection.wait_for_link(config.SERIAL_LINK_RECOVERY_TIMEOUT):
+        return False
+
+    print("[Async Master] Link to VEX brain restored, replanning...")
+    return True
+
+
+async def main():
+    print("[Async Master] Starting task...")
+
+    print("[Async Master] Initialising VEX arm model...")
+    arm = ArmModel(config.X_LIMIT, config.Y_LIMIT, config.Z_LIMIT)
+    print(f"[Async Master] Ready to plan {(time.perf_counter() - START_TIME) * 1000:.0f}ms after start up")
+
+    # Vision polling carries on in the background while the arm is moving
+    watcher = ObjectWatcher()
+    watcher_task = asyncio.create_task(watcher.run())
+
+    print("[Async Master] Opening serial connection to VEX...")
+    try:
+        async with AsyncSerialConnection() as connection:
+            while True:
+                # Drop objects the arm can't possibly reach before planning for them, they're still
+                # in the way of drop off targets
+                detected_objects = watcher.objects
+                objects = [o for o in detected_objects if arm.is_reachable(o.mid_x, o.mid_y, config.Z_AXIS_TOLERANCE)]
+                if len(objects) != len(detected_objects):
+                    print(f"[Async Master] Skipping {len(detected_objects) - len(objects)} objects out of the arm's reach")
+
+                target_objects = decide_target_objects_order(objects)
+                if not target_objects:
+                    print("[Async Master] No valid targets found.")
+                    await asyncio.sleep(2)
+                    continue
+
+                destinations = decide_target_objects_destination(target_objects, arm, detected_objects)
+
+                for object_x, object_y, destination_x, destination_y in destinations:
+                    if destination_x is None or destination_y is None:
+                        print(f"[Async Master] No target position assigned for object at ({object_x}, {object_y})")
+                        continue
+
+                    result = await pickup_object(arm, connection, watcher, object_x, object_y)
+                    if result == "lost_connection":
+                        return
+                    if result == "replan":
+                        break
+                    if result == "unreachable":
+                        print("[Async Master] Unreachable object, skipping to next object...")
+                        continue
+
+                    print("[Async Master] calculating drop off joint angles...")
+                    joint_angles_dropoff = arm.calc_joint_degrees(0, 13, DROP_OFF_Z)
+                    if not joint_angles_dropoff[0]:
+                        print(f"[Async Master] Drop off position ({destination_x}, {destination_y}) is unreachable")
+                        continue
+
+                    is_direct = arm.is_direct_path_clear(arm.commanded_pose, joint_angles_dropoff[1:])
+                    is_done = await connection.move(
+                        joint_angles_dropoff[1], joint_angles_dropoff[2], joint_angles_dropoff[3], False, VEX_TIMEOUT,
+                        is_direct, config.SPEED_PROFILE_TRANSIT)
+                    if not is_done:
+                        is_recovered = await recover_link(connection)
+                        set_measured_pose(arm, connection)
+                        if is_recovered:
+                            break
+                        print(f"[Async Master] Timed out while waiting for vex brain to respond, please check that the vex brain is operating correctly")
+                        return
+                    arm.set_commanded_pose(*joint_angles_dropoff[1:])
+
+                    # Short cool down between actions
+                    await asyncio.sleep(1)
+
+                await asyncio.sleep(1)
+    finally:
+        watcher_task.cancel()
+        try:
+            await watcher_task
+        except asyncio.CancelledError:
+            pass
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("[Async Master] Stopped")
@@ -0,0 +1,322 @@
+import asyncio, time, serial, config
+import protocol
+from serial_telemetry import SerialTelemetry
+
+
+class AsyncSerialConnection():
+    """
+    asyncio version of serial_communication.SerialConnection for the async master, speaking the
+    same protocol without any threads.
+
+    Where the port has a selectable file descriptor the event loop is notified as soon as data
+    arrives, otherwise, i.e. Windows COM ports, the port is polled every
+    config.ASYNC_SERIAL_POLL_INTERVAL seconds.
+
+    The brain's heartbeats are watched the same way, see is_link_up. Commands are sent one at a
+    time, the brain's latest queue status is kept in queue_status and its latest motor state in motor_state.
+    """
+    def __init__(self, port=config.SERIAL_PORT, baudrate=config.SERIAL_BAUDRATE):
+        self.port = port
+        self.baudrate = baudrate
+
+        self.serial = None
+        self.frames = asyncio.Queue()
+        self.decoder = protocol.FrameDecoder()
+        self.poll_task = None
+        self.reader_fd = None
+
+        self.request_lock = asyncio.Lock()
+        self.seq = protocol.first_seq()
+        # Latest protocol.QueueStatus reported by the brain
+        self.queue_status = None
+        # Latest protocol.MotorState streamed by the brain
+        self.motor_state = None
+
+        self.last_accept_latency = None
+        self.last_round_trip = None
+        self.telemetry = SerialTelemetry()
+
+        if config.SERIAL_HEARTBEAT_INTERVAL is None:
+            self.link_timeout = None
+        else:
+            self.link_timeout = config.SERIAL_HEARTBEAT_INTERVAL * config.SERIAL_HEARTBEAT_MISSED_BEATS
+        self.last_heard = None
+        self.last_heartbeat_seq = None
+        self.missed_heartbeats = 0
+
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+
+    @property
+    def is_open(self) -> bool:
+        return self.serial is not None and self.serial.is_open
+
+
+    async def open(self):
+        if self.is_open:
+            return
+
+        # Non blocking reads, only whatever has already arrived is returned
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=0)
+        self.decoder = protocol.FrameDecoder()
+        if self.last_heard is None:
+            # The brain has until the first heartbeats are due to be heard from
+            self.last_heard = time.perf_counter()
+
+        loop = asyncio.get_running_loop()
+        try:
+            self.reader_fd = self.serial.fileno()
+            loop.add_reader(self.reader_fd, self.read_available)
+        except (AttributeError, NotImplementedError, OSError, ValueError):
+            self.reader_fd = None
+            self.poll_task = asyncio.create_task(self.poll_port())
+
+
+    async def close(self):
+        if self.reader_fd is not None:
+            asyncio.get_running_loop().remove_reader(self.reader_fd)
+            self.reader_fd = None
+
+        if self.poll_task is not None:
+            self.poll_task.cancel()
+            try:
+                await self.poll_task
+            except asyncio.CancelledError:
+                pass
+            self.poll_task = None
+
+        if self.serial is not None:
+            self.serial.close()
+            self.serial = None
+
+
+    async def reconnect(self):
+        print(f"[Serial] Reconnecting to {self.port}...")
+        await self.close()
+        await self.open()
+
+
+    def read_available(self):
+        try:
+            data = self.serial.read(max(1, self.serial.in_waiting))
+        except (serial.SerialException, OSError) as ex:
+            # The port is reopened by the next write
+            print(f"[Serial] Read from {self.port} failed: {ex}")
+            if self.reader_fd is not None:
+                asyncio.get_running_loop().remove_reader(self.reader_fd)
+                self.reader_fd = None
+            self.serial.close()
+            return
+        if data:
+            self.last_heard = time.perf_counter()
+            self.telemetry.on_receive(len(data))
+
+        for frame in self.decoder.feed(data):
+            if frame.type == protocol.HEARTBEAT:
+                self.on_heartbeat(frame.seq)
+            elif frame.type == protocol.QUEUE_STATUS:
+                self.queue_status = protocol.decode_queue_status(frame)
+            elif frame.type == protocol.MOTOR_STATE:
+                self.motor_state = protocol.decode_motor_state(frame, time.perf_counter()) or self.motor_state
+            else:
+                self.frames.put_nowait(frame)
+
+
+    def on_heartbeat(self, seq: int):
+        if self.last_heartbeat_seq is not None:
+            self.missed_heartbeats += (seq - self.last_heartbeat_seq - 1) % protocol.SEQUENCE_MODULO
+        self.last_heartbeat_seq = seq
+
+
+    @property
+    def is_link_up(self) -> bool:
+        """
+        False once the brain hasn't been heard from for the link timeout, always True if the
+        brain doesn't send heartbeats.
+        """
+        if self.link_timeout is None:
+            return True
+        return self.last_heard is not None and time.perf_counter() - self.last_heard <= self.link_timeout
+
+
+    async def wait_for_link(self, timeout: float) -> bool:
+        """
+        Waits for the brain to be heard from, reopening the port every reconnect delay.
+        Returns False if the link is still down after the timeout.
+        """
+        deadline = time.perf_counter() + timeout
+        last_reconnect = time.perf_counter()
+        try:
+            await self.open()
+        except serial.SerialException as ex:
+            print(f"[Serial] Opening {self.port} failed: {ex}")
+        while not (self.is_open and self.is_link_up):
+            now = time.perf_counter()
+            if now >= deadline:
+                return False
+            if now - last_reconnect >= config.SERIAL_RECONNECT_DELAY:
+                last_reconnect = now
+                try:
+                    await self.reconnect()
+                except serial.SerialException as ex:
+                    print(f"[Serial] Reconnect to {self.port} failed: {ex}")
+            await asyncio.sleep(config.SERIAL_READ_TIMEOUT)
+        return True
+
+
+    async def poll_port(self):
+        while self.is_open:
+            if self.serial.in_waiting:
+                self.read_available()
+            await asyncio.sleep(config.ASYNC_SERIAL_POLL_INTERVAL)
+
+
+    async def write(self, data: bytes, timing=None):
+        """Writes data to the port, timing is the command it's sent for if any, see SerialTelemetry.on_send."""
+        try:
+            if not self.is_open:
+                await self.reconnect()
+            self.serial.write(data)
+        except (serial.SerialException, OSError):
+            await self.reconnect()
+            self.serial.write(data)
+        self.telemetry.on_send(len(data), timing)
+
+
+    def next_seq(self) -> int:
+        self.seq = protocol.next_seq(self.seq)
+        return self.seq
+
+
+    async def wait_for_reply(self, seq: int, timeout: float, timing=None):
+        """
+        Waits for a reply to the command, see protocol.is_reply_to. Replies to other commands
+        are discarded. Returns None if nothing arrives within the timeout, or as soon as the link goes down.
+        Replies echoing the sequence number are recorded against the command's timing if given.
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not self.is_link_up:
+                return None
+
+            try:
+                # Wakes up at least every read timeout to notice the link going down
+                async with asyncio.timeout(min(remaining, config.SERIAL_READ_TIMEOUT)):
+                    frame = await self.frames.get()
+            except TimeoutError:
+                continue
+
+            if protocol.is_reply_to(frame, seq):
+                if timing is not None and frame.seq == seq:
+                    self.telemetry.on_reply(timing, protocol.FRAME_OVERHEAD + len(frame.payload))
+                return frame
+            print(f"[Serial] Discarding unexpected frame: type {frame.type:#04x} seq {frame.seq}")
+
+
+    async def request(self, frame_type: int, payload=b"", timeout=20, on_progress=None) -> bool:
+        """
+        Sends a command and waits for the brain to carry it out, resending it if it's not
+        accepted in time. See serial_communication.SerialConnection.request.
+        """
+        await self.open()
+        async with self.request_lock:
+            while not self.frames.empty():
+                stale = self.frames.get_nowait()
+                print(f"[Serial] Discarding stale frame: type {stale.type:#04x} seq {stale.seq}")
+
+            seq = self.next_seq()
+            data = protocol.encode_frame(frame_type, seq, payload)
+            timing = self.telemetry.start_command(frame_type, seq)
+            start = timing.send
+
+            try:
+                reply = None
+                for attempt in range(config.SERIAL_COMMAND_RETRIES + 1):
+                    if not self.is_link_up:
+                        print(f"[Serial] Link down, giving up on command {seq}")
+                        break
+                    if attempt > 0:
+                        print(f"[Serial] Resending command {seq}, attempt {attempt + 1}")
+                    await self.write(data, timing)
+
+                    reply = await self.wait_for_reply(seq, config.SERIAL_ACK_TIMEOUT, timing)
+                    if reply is not None and reply.type != protocol.NACK:
+                        break
+                    if reply is not None:
+                        print(f"[Serial] Command {seq} rejected, status {protocol.decode_status(reply.payload)}")
+                        reply = None
+
+                if reply is None:
+                    self.last_accept_latency = None
+                    self.last_round_trip = None
+                    return False
+                timing.accepted = time.perf_counter()
+                self.last_accept_latency = timing.accepted - start
+
+                # Resent every config.SERIAL_DONE_RESEND_INTERVAL without a DONE in case it was lost
+                last_sent = time.perf_counter()
+                while reply is None or reply.type != protocol.ACK or protocol.decode_status(reply.payload) != protocol.DONE:
+                    if reply is not None and reply.type == protocol.PROGRESS and on_progress is not None:
+                        on_progress(protocol.decode_progress(reply.payload))
+                    if reply is not None and reply.type == protocol.ACK and protocol.decode_status(reply.payload) == protocol.FAILED:
+                        print(f"[Serial] Command {seq} failed, the arm didn't reach its position")
+                        self.last_round_trip = None
+                        return False
+
+                    now = time.perf_counter()
+                    remaining = timeout - (now - start)
+                    if remaining <= 0 or not self.is_link_up:
+                        self.last_round_trip = None
+                        return False
+
+                    resend_in = config.SERIAL_DONE_RESEND_INTERVAL - (now - last_sent)
+                    if resend_in <= 0:
+                        last_sent = now
+                        reply = None
+                        try:
+                            await self.write(data, timing)
+                        except (serial.SerialException, OSError) as ex:
+                            print(f"[Serial] Resending command {seq} failed: {ex}")
+                        continue
+
+                    reply = await self.wait_for_reply(seq, min(remaining, resend_in), timing)
+
+                timing.done = time.perf_counter()
+                self.last_round_trip = timing.done - start
+                return True
+            finally:
+                self.telemetry.finish_command(timing)
+
+
+    async def move(self, base: float, shoulder: float, elbow: float, pickup: bool, timeout=20, direct=False,
+                   profile=None) -> bool:
+        payload = protocol.encode_move([base, shoulder, elbow], pickup, direct, profile)
+        return await self.request(protocol.MOVE, payload, timeout)
+
+
+    async def move_sequence(self, waypoints, timeout=20, on_progress=None) -> bool:
+        return await self.request(protocol.SEQUENCE, protocol.encode_sequence(waypoints), timeout, on_progress)
+
+
+    async def alarm(self, message: str, timeout=20) -> bool:
+        return await self.request(protocol.ALARM, message.encode()[:protocol.MAX_PAYLOAD], timeout)
+
+
+    def measured_pose(self, max_age=config.SERIAL_MOTOR_STATE_MAX_AGE) -> list:
+        """See serial_communication.SerialConnection.measured_pose."""
+        state = self.motor_state
+        if state is None or time.perf_counter() - state.received > max_age:
+            return None
+        return list(state.positions)
+
+
+    def stats(self) -> dict:
+        return self.telemetry.stats()
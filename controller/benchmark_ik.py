@@ -0,0 +1,137 @@
+import json, sys, time
+from collections import deque
+import numpy as np
+import config
+import kinematics
+from arm_model import ArmModel
+from ik_table import IKTable
+
+# Spacing of the targets swept over the workspace, each target is jittered within its cell
+BENCHMARK_STEP = 2.0
+BENCHMARK_SEED = 0
+# Rounding applied to solved angles, high so the solvers accuracy is measured rather than the rounding
+BENCHMARK_DEC_PLACES = 6
+
+BENCHMARK_SOLVERS = ["analytic", "table", "iterative"]
+BENCHMARK_OUTPUT_PATH = "ik_benchmark.json"
+
+
+def benchmark_targets() -> np.ndarray:
+    """
+    Targets covering the configured workspace at the heights the master requests.
+    Seeded so every run uses the same targets.
+    """
+    x_axis = np.arange(config.X_LIMIT[0], config.X_LIMIT[1], BENCHMARK_STEP)
+    y_axis = np.arange(config.Y_LIMIT[0], config.Y_LIMIT[1], BENCHMARK_STEP)
+    z_axis = np.array(config.IK_TABLE_Z_LEVELS, dtype=np.float64)
+
+    z_grid, y_grid, x_grid = np.meshgrid(z_axis, y_axis, x_axis, indexing="ij")
+    targets = np.stack((x_grid.ravel(), y_grid.ravel(), z_grid.ravel()), axis=-1)
+
+    jitter = np.random.default_rng(BENCHMARK_SEED).uniform(0, BENCHMARK_STEP, (len(targets), 2))
+    targets[:, 0:2] += jitter
+    return targets
+
+
+def benchmark_solver(solver, targets, reference_reachable) -> dict:
+    """
+    Solves every target with the solver, bypassing the cache, and measures its speed and accuracy.
+
+    Parameters
+    ----------
+    solver: str
+        One of the ArmModel solvers, "analytic", "table" or "iterative".
+    targets: np.ndarray
+        Targets as an array of shape (N, 3) of x, y, z coordinates.
+    reference_reachable: np.ndarray
+        Reachability of each target from the analytic solver, which is exact.
+
+    Returns
+    -------
+    results: dict
+    """
+    # Measure each solver on its own rather than falling back to the iterative solver
+    fallback = config.IK_ITERATIVE_FALLBACK
+    config.IK_ITERATIVE_FALLBACK = False
+
+    arm = ArmModel(config.X_LIMIT, config.Y_LIMIT, config.Z_LIMIT, solver=solver)
+    if solver == "table" and arm.table is None:
+        print("[Benchmark] No saved IK table, building one in memory")
+        arm.table = IKTable.build(config.X_LIMIT, config.Y_LIMIT, config.IK_TABLE_Z_LEVELS, config.IK_TABLE_STEP)
+    # Keep every iteration count rather than the most recent
+    arm.iteration_counts = deque()
+
+    latencies = np.empty(len(targets), dtype=np.float64)
+    reachable = np.empty(len(targets), dtype=bool)
+    angles = np.empty((len(targets), 3), dtype=np.float64)
+
+    try:
+        # Plain floats like the master passes, NumPy scalars are much slower with the math module
+        for i, (x, y, z) in enumerate(targets.tolist()):
+            start = time.perf_counter()
+            result = arm.solve_joint_degrees(x, y, z, BENCHMARK_DEC_PLACES)
+            latencies[i] = time.perf_counter() - start
+
+            reachable[i] = result[0]
+            angles[i] = result[1:]
+    finally:
+        config.IK_ITERATIVE_FALLBACK = fallback
+
+    # Round trip the reachable solutions through forward kinematics to see how close they got
+    end_positions = kinematics.forward_batch(angles[reachable], arm.dh_params)[:, -2]
+    position_errors = np.linalg.norm(end_positions - targets[reachable], axis=1)
+
+    iterations = np.array(arm.iteration_counts, dtype=np.float64)
+
+    return {
+        "solver": solver,
+        "solves": len(targets),
+        "total_seconds": float(latencies.sum()),
+        "solves_per_second": float(len(targets) / latencies.sum()),
+        "latency_p50_us": float(np.percentile(latencies, 50) * 1e6),
+        "latency_p99_us": float(np.percentile(latencies, 99) * 1e6),
+        "latency_max_us": float(latencies.max() * 1e6),
+        "iterative_solves": len(iterations),
+        "iterations_mean": float(iterations.mean()) if len(iterations) else None,
+        "iterations_p50": float(np.percentile(iterations, 50)) if len(iterations) else None,
+        "iterations_p99": float(np.percentile(iterations, 99)) if len(iterations) else None,
+        "reachable": int(reachable.sum()),
+        "reachability_agreement": float(np.mean(reachable == reference_reachable)),
+        "false_reachable": int(np.sum(reachable & ~reference_reachable)),
+        "false_unreachable": int(np.sum(~reachable & reference_reachable)),
+        "position_error_mean": float(position_errors.mean()) if len(position_errors) else None,
+        "position_error_max": float(position_errors.max()) if len(position_errors) else None
+    }
+
+
+def main():
+    output_path = sys.argv[1] if len(sys.argv) > 1 else BENCHMARK_OUTPUT_PATH
+
+    targets = benchmark_targets()
+    reference_reachable = kinematics.solve_analytic_batch(
+        targets, kinematics.DH_PARAMS, config.JOINT_LIMITS, config.IK_ELBOW_UP)["reachable"]
+    print(f"[Benchmark] {len(targets)} targets, {int(reference_reachable.sum())} reachable")
+
+    results = []
+    for solver in BENCHMARK_SOLVERS:
+        print(f"[Benchmark] Running {solver} solver...")
+        result = benchmark_solver(solver, targets, reference_reachable)
+        results.append(result)
+
+        print(f"[Benchmark] {solver}: {result['solves_per_second']:.0f} solves/s, "
+              f"p50 {result['latency_p50_us']:.1f}us, p99 {result['latency_p99_us']:.1f}us, "
+              f"reachability agreement {result['reachability_agreement']:.3f}, "
+              f"max position error {result['position_error_max']}")
+
+    with open(output_path, "w") as f:
+        json.dump({
+            "step": BENCHMARK_STEP,
+            "seed": BENCHMARK_SEED,
+            "z_levels": config.IK_TABLE_Z_LEVELS,
+            "results": results
+        }, f, indent=2)
+    print(f"[Benchmark] Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,613 @@
+import argparse, math, os, pty, queue, random, select, sys, threading, time, tty
+from collections import deque
+import config
+import protocol
+from protocol import Waypoint, ACTION_PICKUP
+from serial_communication import SerialConnection
+
+# Must match vex/src/main.py
+SHOULDER_GEAR_RATIO = 2.5
+DEFAULT_VELOCITY = 5
+BLEND_TOLERANCE = 5
+QUEUE_CAPACITY = 8
+DONE_HISTORY = 16
+MOVE_TIMEOUT_FACTOR = 3
+# Seconds, milliseconds on the brain
+MOVE_TIMEOUT_MARGIN = 2.0
+
+
+class BrainEmulator():
+    """
+    Stand in for the VEX brain on a Linux pseudo terminal, speaking the same protocol as
+    vex/src/main.py. The controller connects to the emulator's port in place of the brain's COM port.
+
+    Moves take as long as the brain's motors would to make them, either turning the joints together
+    or one at a time in the same order as the brain, see CONCURRENT_MOTION in vex/src/main.py.
+    Moves are queued and carried out in order while further commands are read, blending positions
+    without a magnet action into the next move like the brain. Replies can be delayed and commands and replies dropped at random
+    to reproduce a slow or lossy link. Heartbeats and motor states are sent like the brain's, setting
+    alive to False makes the emulator go silent as if the brain had been switched off. Joints in
+    stalled_joints don't turn, so moves needing them time out and fail like the brain's.
+
+    Parameters
+    ----------
+    seconds_per_degree: float
+        Seconds for a motor to turn one degree at the brain's default velocity, moves with a speed
+        profile are faster or slower in proportion to its velocity.
+    joint_speeds: list
+        Speed of the base, shoulder and elbow motors relative to the default velocity.
+    reply_delay: float
+        Seconds added before every reply, like link latency it doesn't hold up the arm.
+    command_drop_rate: float
+        Chance of a received command being ignored as if it was lost on the way.
+    reply_drop_rate: float
+        Chance of a reply not being sent.
+    time_scale: float
+        Multiplies every motion time, less than 1 runs the arm faster than real time.
+    seed: int
+        Seeds the drops so a run can be reproduced.
+    heartbeat_interval: float
+        Seconds between heartbeats, None to send none.
+    concurrent_motion: bool
+        Turn the joints together so a move takes as long as its slowest joint, otherwise one at a time.
+    motor_state_interval: float
+        Seconds between motor states, None to send none.
+    """
+    def __init__(self, seconds_per_degree=config.EMULATOR_SECONDS_PER_DEGREE,
+                 joint_speeds=config.EMULATOR_JOINT_SPEEDS, reply_delay=config.EMULATOR_REPLY_DELAY,
+                 command_drop_rate=config.EMULATOR_COMMAND_DROP_RATE,
+                 reply_drop_rate=config.EMULATOR_REPLY_DROP_RATE, time_scale=1.0, seed=None,
+                 heartbeat_interval=config.SERIAL_HEARTBEAT_INTERVAL,
+                 concurrent_motion=config.EMULATOR_CONCURRENT_MOTION,
+                 motor_state_interval=config.SERIAL_MOTOR_STATE_INTERVAL):
+        self.seconds_per_degree = seconds_per_degree
+        self.joint_speeds = list(joint_speeds)
+        self.reply_delay = reply_delay
+        self.command_drop_rate = command_drop_rate
+        self.reply_drop_rate = reply_drop_rate
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.heartbeat_interval = heartbeat_interval
+        self.concurrent_motion = concurrent_motion
+        self.motor_state_interval = motor_state_interval
+        self.alive = True
+        self.stalled_joints = set()
+
+        # Motor positions in motor degrees, the brain's motors start at zero
+        self.motor_positions = [0.0, 0.0, 0.0]
+        self.magnet_on = False
+        # Move in progress as (perf_counter started, seconds, {joint: (from, to) motor degrees}), None when still
+        self.motion = None
+        self.alarm_message = None
+
+        # Commands waiting to be carried out as (seq, is_sequence, waypoints), see vex/src/main.py
+        self.command_queue = deque()
+        self.queue_changed = threading.Condition()
+        self.executing_seq = None
+        # (seq, status) of the last commands finished, status is protocol.DONE or protocol.FAILED
+        self.done_seqs = deque(maxlen=DONE_HISTORY)
+
+        self.commands_received = 0
+        self.commands_dropped = 0
+        self.replies_dropped = 0
+
+        self.master_fd = None
+        self.slave_fd = None
+        self.port = None
+        self.thread = None
+        self.executor_thread = None
+        self.heartbeat_thread = None
+        self.motor_state_thread = None
+        self.stop_event = threading.Event()
+        # Replies and heartbeats are sent from different threads
+        self.write_lock = threading.Lock()
+        # Delayed replies as (perf_counter due, frame bytes), in the order they were sent
+        self.outbox = queue.Queue()
+        self.outbox_thread = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+    def start(self) -> str:
+        """
+        Opens the pseudo terminal and starts answering commands, returns the port to connect to.
+        """
+        self.master_fd, slave_fd = pty.openpty()
+        # Raw so bytes pass through untouched, i.e. no echo or newline translation
+        tty.setraw(self.master_fd)
+        tty.setraw(slave_fd)
+        self.port = os.ttyname(slave_fd)
+        # The controller opens the port by name, this copy is kept open so the pty isn't torn
+        # down between the controller closing and reopening it
+        self.slave_fd = slave_fd
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.serial_monitor, name="BrainEmulator", daemon=True)
+        self.thread.start()
+        self.executor_thread = threading.Thread(target=self.command_executor, name="BrainEmulatorExecutor", daemon=True)
+        self.executor_thread.start()
+        self.outbox_thread = threading.Thread(target=self.outbox_monitor, name="BrainEmulatorOutbox", daemon=True)
+        self.outbox_thread.start()
+        if self.heartbeat_interval is not None:
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat_monitor, name="BrainEmulatorHeartbeat", daemon=True)
+            self.heartbeat_thread.start()
+        if self.motor_state_interval is not None:
+            self.motor_state_thread = threading.Thread(target=self.motor_state_monitor, name="BrainEmulatorMotorState", daemon=True)
+            self.motor_state_thread.start()
+        return self.port
+
+
+    def stop(self):
+        self.stop_event.set()
+        with self.queue_changed:
+            self.queue_changed.notify_all()
+        for thread in (self.thread, self.executor_thread, self.outbox_thread, self.heartbeat_thread,
+                       self.motor_state_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join()
+        for fd in (self.master_fd, self.slave_fd):
+            try:
+                os.close(fd)
+            except (OSError, TypeError):
+                pass
+        self.master_fd = None
+        self.slave_fd = None
+        self.thread = None
+        self.executor_thread = None
+        self.outbox_thread = None
+        self.heartbeat_thread = None
+        self.motor_state_thread = None
+
+
+    def read_frames(self):
+        decoder = protocol.FrameDecoder()
+        while not self.stop_event.is_set():
+            try:
+                # Wakes up regularly to notice when the emulator is stopped
+                readable, _, _ = select.select([self.master_fd], [], [], 0.1)
+                if not readable:
+                    continue
+                data = os.read(self.master_fd, 512)
+            except OSError:
+                return
+            if not data:
+                return
+
+            corrupted = decoder.corrupted
+            frames = decoder.feed(data)
+            # The brain answers a corrupted frame with a NACK
+            for _ in range(decoder.corrupted - corrupted):
+                yield None
+            yield from frames
+
+
+    def send_frame(self, frame_type: int, seq: int, payload=b""):
+        if self.random.random() < self.reply_drop_rate:
+            self.replies_dropped += 1
+            return
+        data = protocol.encode_frame(frame_type, seq, payload)
+        if self.reply_delay > 0:
+            self.outbox.put((time.perf_counter() + self.reply_delay, data))
+        else:
+            self.write(data)
+
+
+    def outbox_monitor(self):
+        while not self.stop_event.is_set():
+            try:
+                due, data = self.outbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.write(data)
+
+
+    def write(self, data: bytes):
+        if not self.alive:
+            return
+        with self.write_lock:
+            try:
+                os.write(self.master_fd, data)
+            except OSError:
+                pass
+
+
+    def heartbeat_monitor(self):
+        beat = 0
+        while not self.stop_event.wait(self.heartbeat_interval):
+            self.write(protocol.encode_frame(protocol.HEARTBEAT, beat))
+            beat = (beat + 1) % protocol.SEQUENCE_MODULO
+
+
+    def motor_state_monitor(self):
+        sample = 0
+        start = time.perf_counter()
+        while not self.stop_event.wait(self.motor_state_interval):
+            positions, velocities = self.measured_state()
+            brain_time_ms = int((time.perf_counter() - start) * 1000)
+            payload = protocol.encode_motor_state(brain_time_ms, positions, velocities, [0.0, 0.0, 0.0], self.magnet_on)
+            self.write(protocol.encode_frame(protocol.MOTOR_STATE, sample, payload))
+            sample = (sample + 1) % protocol.SEQUENCE_MODULO
+
+
+    def measured_state(self) -> tuple:
+        """
+        Joint degrees and degrees per second the brain's motors would measure now, part way
+        through the move in progress.
+        """
+        positions = list(self.motor_positions)
+        velocities = [0.0, 0.0, 0.0]
+        motion = self.motion
+        if motion is not None:
+            started, duration, targets = motion
+            progress = min(1.0, (time.perf_counter() - started) / duration)
+            for joint, (position_from, position_to) in targets.items():
+                positions[joint] = position_from + (position_to - position_from) * progress
+                if progress < 1:
+                    velocities[joint] = (position_to - position_from) / duration
+
+        ratios = [1, SHOULDER_GEAR_RATIO, 1]
+        return [p / r for p, r in zip(positions, ratios)], [v / r for v, r in zip(velocities, ratios)]
+
+
+    def send_ack(self, seq: int, status: int):
+        self.send_frame(protocol.ACK, seq, protocol.encode_status(status))
+
+
+    def send_nack(self, seq: int, status: int):
+        self.send_frame(protocol.NACK, seq, protocol.encode_status(status))
+
+
+    def send_queue_status(self):
+        with self.queue_changed:
+            seq = self.executing_seq if self.executing_seq is not None else 0
+            payload = protocol.encode_queue_status(len(self.command_queue), QUEUE_CAPACITY)
+        self.send_frame(protocol.QUEUE_STATUS, seq, payload)
+
+
+    def motion_time(self, joint: int, position: float, velocity=DEFAULT_VELOCITY, acceleration=0,
+                    blend=False) -> float:
+        """
+        Seconds for the joint's motor to reach the position in motor degrees at the velocity percent,
+        ramping up to it at the acceleration percent per second if it's not 0. Blending only waits
+        until it's within BLEND_TOLERANCE.
+        """
+        distance = abs(position - self.motor_positions[joint])
+        if blend:
+            distance = max(0.0, distance - BLEND_TOLERANCE)
+        # Motor degrees per second at full velocity
+        rate = velocity / DEFAULT_VELOCITY * self.joint_speeds[joint] / self.seconds_per_degree
+        if rate <= 0:
+            return 0.0
+
+        duration = distance / rate
+        if acceleration > 0:
+            ramp_time = velocity / acceleration
+            ramp_distance = rate * ramp_time / 2
+            if distance >= ramp_distance:
+                duration = ramp_time + (distance - ramp_distance) / rate
+            else:
+                duration = math.sqrt(2 * distance * ramp_time / rate)
+        return duration * self.time_scale
+
+
+    def spin_to_position(self, joint: int, position: float, velocity=DEFAULT_VELOCITY, acceleration=0) -> bool:
+        """
+        Turns the joint's motor to the position in motor degrees, taking as long as the motor would.
+        """
+        return self.move_together([joint], [position], velocity, acceleration)
+
+
+    def move_together(self, joints, positions, velocity=DEFAULT_VELOCITY, acceleration=0, blend=False) -> bool:
+        """
+        Turns the joints' motors together, taking as long as the slowest one would. If a joint
+        which has to turn is stalled the rest turn, then it gives up after the brain's move
+        timeout and returns False.
+        """
+        durations = [self.motion_time(joint, position, velocity, acceleration, blend)
+                     for joint, position in zip(joints, positions)]
+        duration = max(durations)
+        is_stalled = any(joint in self.stalled_joints and joint_duration > 0
+                         for joint, joint_duration in zip(joints, durations))
+        moving = [(joint, position) for joint, position in zip(joints, positions) if joint not in self.stalled_joints]
+
+        if duration > 0:
+            self.motion = (time.perf_counter(), duration,
+                           {joint: (self.motor_positions[joint], position) for joint, position in moving})
+            if is_stalled:
+                time.sleep(duration * MOVE_TIMEOUT_FACTOR + MOVE_TIMEOUT_MARGIN * self.time_scale)
+            else:
+                time.sleep(duration)
+        for joint, position in moving:
+            self.motor_positions[joint] = position
+        self.motion = None
+
+        if is_stalled:
+            self.alarm_message = "Move timed out"
+            return False
+        return True
+
+
+    def move(self, angles, direct=False, velocity=0, acceleration=0, blend=False):
+        """
+        Same motion as the brain's move, through the neutral position unless direct, at the speed
+        profile's velocity or the default velocity if 0. Returns False as soon as a part of it fails.
+        """
+        velocity = velocity or DEFAULT_VELOCITY
+        target = [angles[0], angles[1] * SHOULDER_GEAR_RATIO, angles[2]]
+        if direct:
+            return self.move_together([0, 1, 2], target, velocity, acceleration, blend)
+
+        if self.concurrent_motion:
+            return (self.move_together([1, 2], [90 * SHOULDER_GEAR_RATIO, 0], velocity, acceleration, True)
+                    and self.move_together([0, 1, 2], target, velocity, acceleration, blend))
+
+        return (self.spin_to_position(1, 90 * SHOULDER_GEAR_RATIO, velocity, acceleration)
+                and self.spin_to_position(2, 0, velocity, acceleration)
+                and self.spin_to_position(0, target[0], velocity, acceleration)
+                and self.spin_to_position(2, target[2], velocity, acceleration)
+                and self.spin_to_position(1, target[1], velocity, acceleration))
+
+
+    def waypoint_move(self, waypoint, blend=False) -> bool:
+        if waypoint.action == protocol.ACTION_PICKUP:
+            self.magnet_on = True
+        # Only positions without a magnet action are passed through
+        if not self.move([waypoint.base, waypoint.shoulder, waypoint.elbow], waypoint.direct,
+                         waypoint.velocity, waypoint.acceleration, blend and waypoint.action == protocol.ACTION_NONE):
+            return False
+        if waypoint.action == protocol.ACTION_DROP:
+            self.magnet_on = False
+        return True
+
+
+    @property
+    def joint_degrees(self) -> list:
+        """Current base, shoulder and elbow angles in degrees."""
+        return [self.motor_positions[0], self.motor_positions[1] / SHOULDER_GEAR_RATIO, self.motor_positions[2]]
+
+
+    def command_executor(self):
+        """
+        Carries out queued commands in order, see command_executor in vex/src/main.py.
+        """
+        while True:
+            with self.queue_changed:
+                while not self.command_queue and not self.stop_event.is_set():
+                    self.queue_changed.wait()
+                if self.stop_event.is_set():
+                    return
+                seq, is_sequence, waypoints = self.command_queue.popleft()
+                self.executing_seq = seq
+            self.send_queue_status()
+            self.alarm_message = None
+
+            is_done = True
+            for i, waypoint in enumerate(waypoints):
+                if not self.waypoint_move(waypoint, i + 1 < len(waypoints) or len(self.command_queue) > 0):
+                    is_done = False
+                    break
+                if is_sequence:
+                    self.send_frame(protocol.PROGRESS, seq, protocol.PROGRESS_PAYLOAD.pack(i))
+
+            with self.queue_changed:
+                finished = [seq]
+                if not is_done:
+                    # Like the brain the queued commands fail along with it
+                    finished += [command[0] for command in self.command_queue]
+                    self.command_queue.clear()
+                status = protocol.DONE if is_done else protocol.FAILED
+                self.done_seqs.extend((finished_seq, status) for finished_seq in finished)
+                self.executing_seq = None
+            for finished_seq in finished:
+                self.send_ack(finished_seq, status)
+            self.send_queue_status()
+
+
+    def done_status(self, seq: int) -> int:
+        """protocol.DONE or protocol.FAILED if the command has finished, None if it hasn't."""
+        with self.queue_changed:
+            for done_seq, status in self.done_seqs:
+                if done_seq == seq:
+                    return status
+        return None
+
+
+    def serial_monitor(self):
+        for frame in self.read_frames():
+            # Switched off, everything sent is lost
+            if not self.alive:
+                continue
+
+            if frame is None:
+                self.send_nack(0, protocol.BAD_CRC)
+                continue
+
+            self.commands_received += 1
+            if self.random.random() < self.command_drop_rate:
+                self.commands_dropped += 1
+                continue
+
+            # The controller resent a command it already sent, the reply must have been lost
+            status = self.done_status(frame.seq)
+            with self.queue_changed:
+                is_queued = frame.seq == self.executing_seq or any(c[0] == frame.seq for c in self.command_queue)
+            if status is not None:
+                self.send_ack(frame.seq, protocol.ACCEPTED)
+                self.send_ack(frame.seq, status)
+                continue
+            if is_queued:
+                self.send_ack(frame.seq, protocol.ACCEPTED)
+                continue
+
+            if frame.type == protocol.ALARM:
+                self.send_ack(frame.seq, protocol.ACCEPTED)
+                self.alarm_message = frame.payload.decode(errors="replace")
+                with self.queue_changed:
+                    self.done_seqs.append((frame.seq, protocol.DONE))
+                self.send_ack(frame.seq, protocol.DONE)
+                continue
+
+            try:
+                if frame.type == protocol.MOVE:
+                    waypoints = [protocol.decode_move(frame.payload)]
+                elif frame.type == protocol.SEQUENCE:
+                    waypoints = protocol.decode_sequence(frame.payload)
+                else:
+                    self.send_nack(frame.seq, protocol.UNKNOWN_TYPE)
+                    continue
+            except Exception:
+                self.send_nack(frame.seq, protocol.BAD_PAYLOAD)
+                continue
+
+            with self.queue_changed:
+                is_full = len(self.command_queue) >= QUEUE_CAPACITY
+                if not is_full:
+                    self.command_queue.append((frame.seq, frame.type == protocol.SEQUENCE, waypoints))
+                    self.queue_changed.notify_all()
+            if is_full:
+                self.send_nack(frame.seq, protocol.QUEUE_FULL)
+                continue
+            self.send_ack(frame.seq, protocol.ACCEPTED)
+            self.send_queue_status()
+
+
+def load_test_payload(i: int):
+    """Frame type and payload of the load test's i-th command."""
+    # Alternate between two poses so every command moves the arm
+    pose = [45, 45, 45] if i % 2 == 0 else [-45, 60, -30]
+    if i % 4 == 3:
+        return protocol.SEQUENCE, protocol.encode_sequence([Waypoint(*pose, ACTION_PICKUP), Waypoint(0, 90, 0, ACTION_PICKUP)])
+    return protocol.MOVE, protocol.encode_move(pose, i % 2 == 0)
+
+
+def load_test(port: str, count: int, timeout: float, pipeline=False):
+    """
+    Sends moves to the port back to back and reports the command throughput and round trip times.
+    If pipeline is set the next command is sent while the brain is carrying out the current one,
+    up to config.SERIAL_PIPELINE_DEPTH at once.
+    """
+    latencies = []
+    failures = 0
+    with SerialConnection(port) as connection:
+        start = time.perf_counter()
+        pending = deque()
+
+        def wait_for_oldest():
+            nonlocal failures
+            command = pending.popleft()
+            if connection.wait_until_done(command, timeout):
+                latencies.append(connection.last_round_trip)
+            else:
+                failures += 1
+
+        for i in range(count):
+            if not pipeline:
+                if connection.request(*load_test_payload(i), timeout):
+                    latencies.append(connection.last_round_trip)
+                else:
+                    failures += 1
+                continue
+
+            # submit blocks while the pipeline is full, so wait for the oldest command first
+            if len(pending) >= config.SERIAL_PIPELINE_DEPTH:
+                wait_for_oldest()
+            command = connection.submit(*load_test_payload(i))
+            if command is None:
+                failures += 1
+            else:
+                pending.append(command)
+        while pending:
+            wait_for_oldest()
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"[Emulator] {count} commands in {elapsed:.2f}s, {count / elapsed:.1f} commands/s, {failures} timed out")
+    if latencies:
+        print(f"[Emulator] Round trip p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+              f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f}ms, "
+              f"max {latencies[-1] * 1000:.1f}ms")
+
+
+def stall_test(emulator, timeout: float) -> bool:
+    """
+    Stalls the elbow and moves the arm with a command queued behind, both must come back as failed
+    well within the timeout rather than done. Returns True if they did.
+    """
+    emulator.stalled_joints = {2}
+    try:
+        with SerialConnection(emulator.port) as connection:
+            start = time.perf_counter()
+            stalled = connection.submit(protocol.MOVE, protocol.encode_move([-45, 60, -30], False, True))
+            queued = connection.submit(protocol.MOVE, protocol.encode_move([45, 45, 45], False, True))
+            if stalled is None or queued is None:
+                print("[Emulator] Stall test commands weren't accepted")
+                return False
+
+            results = [connection.wait_until_done(stalled, timeout), connection.wait_until_done(queued, timeout)]
+            elapsed = time.perf_counter() - start
+    finally:
+        emulator.stalled_joints = set()
+
+    is_failed = results == [False, False] and elapsed < timeout
+    print(f"[Emulator] Stalled move {'failed' if is_failed else 'did not fail'} after {elapsed:.2f}s, "
+          f"results {results}, alarm {emulator.alarm_message!r}")
+    return is_failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulates the VEX brain on a pseudo terminal")
+    parser.add_argument("--seconds-per-degree", type=float, default=config.EMULATOR_SECONDS_PER_DEGREE)
+    parser.add_argument("--joint-speeds", type=float, nargs=3, default=config.EMULATOR_JOINT_SPEEDS,
+                        metavar=("BASE", "SHOULDER", "ELBOW"))
+    parser.add_argument("--reply-delay", type=float, default=config.EMULATOR_REPLY_DELAY)
+    parser.add_argument("--command-drop-rate", type=float, default=config.EMULATOR_COMMAND_DROP_RATE)
+    parser.add_argument("--reply-drop-rate", type=float, default=config.EMULATOR_REPLY_DROP_RATE)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--heartbeat-interval", type=float, default=config.SERIAL_HEARTBEAT_INTERVAL)
+    parser.add_argument("--motor-state-interval", type=float, default=config.SERIAL_MOTOR_STATE_INTERVAL)
+    parser.add_argument("--sequential-motion", action="store_true", help="Turn the joints one at a time")
+    parser.add_argument("--load-test", type=int, default=0, metavar="COMMANDS",
+                        help="Send this many commands to the emulator then exit")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds each load test command has to be done")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Send load test commands while the previous ones are still running")
+    parser.add_argument("--stall-test", action="store_true",
+                        help="Check a move with a stalled joint fails rather than being done, then exit")
+    args = parser.parse_args()
+
+    emulator = BrainEmulator(args.seconds_per_degree, args.joint_speeds, args.reply_delay,
+                             args.command_drop_rate, args.reply_drop_rate, args.time_scale, args.seed,
+                             args.heartbeat_interval, not args.sequential_motion, args.motor_state_interval)
+    with emulator:
+        print(f"[Emulator] VEX brain emulator listening on {emulator.port}")
+
+        if args.stall_test:
+            sys.exit(0 if stall_test(emulator, args.timeout) else 1)
+
+        if args.load_test:
+            load_test(emulator.port, args.load_test, args.timeout, args.pipeline)
+            print(f"[Emulator] {emulator.commands_received} commands received, "
+                  f"{emulator.commands_dropped} dropped, {emulator.replies_dropped} replies dropped")
+            return
+
+        print(f"[Emulator] Set SERIAL_PORT in config.py to {emulator.port}, Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -13,3 +13,125 @@ Z_AXIS_TOLERANCE = 8
 # COM6 for wired connection with VEX brain but check before running app
 SERIAL_PORT = "COM4"
 SERIAL_BAUDRATE = 115200
+
+# Inverse kinematics config
+# "analytic" uses the closed-form solver, "iterative" the visual_kinematics numerical solver
+# and "table" interpolates in the precomputed table built by ik_table.py
+IK_SOLVER = "analytic"
+# Retry with the iterative solver if the analytic solver can't reach the target
+IK_ITERATIVE_FALLBACK = True
+# Prefer the elbow-up solution, keeps the lower link clear of the workspace floor
+IK_ELBOW_UP = True
+# [min, max] degrees for base, shoulder and elbow joints
+JOINT_LIMITS = [[-180, 180], [-45, 180], [-150, 150]]
+
+# Precomputed IK table config, rebuild by running ik_table.py after changing these
+IK_TABLE_PATH = "ik_table.npz"
+# Grid spacing on the x and y axes
+IK_TABLE_STEP = 0.5
+# Heights to sample, 1cm apart covering the pickup and drop off heights the master requests.
+# Queries between levels are interpolated so keep levels close together
+IK_TABLE_Z_LEVELS = list(range(Z_AXIS_TOLERANCE, Z_AXIS_TOLERANCE + 6))
+
+# Solved target cache config
+# Number of targets kept, 0 disables the cache
+IK_CACHE_SIZE = 256
+# Targets are snapped to this grid before solving so nearby requests share an entry, 1mm
+IK_CACHE_RESOLUTION = 0.1
+
+# Iterative solver warm start config
+# "nearest" seeds from the closest previously solved target, "commanded" from the pose last
+# sent to the arm and "quadrant" from the base facing the targets quadrant
+IK_WARM_START = "nearest"
+# Number of solved targets kept as seeds
+IK_WARM_START_HISTORY = 64
+# Number of iterative solves iteration counts are kept for
+IK_ITERATION_HISTORY = 1000
+
+# Reachability map grid spacing, used to reject unreachable targets before solving
+REACHABILITY_RESOLUTION = 0.25
+
+# Pose safety checks config
+# Minimum height of the elbow and end frame above the workspace floor (Z_LIMIT[0])
+FLOOR_CLEARANCE = 1.0
+# Height of the camera above the centre of the workspace
+CAMERA_HEIGHT = 70
+# Band along the x axis the arm can occupy without hiding objects from the camera, the dead zone
+CAMERA_DEAD_ZONE_Y = [-10, 10]
+# Poses sampled along a direct move when checking it stays clear of the floor
+DIRECT_PATH_SAMPLES = 20
+
+# Speed profiles sent with each move, [velocity percent, acceleration percent per second].
+# The slowest joint of a move runs at the velocity and the others slower to arrive with it,
+# an acceleration of 0 starts at full velocity
+SPEED_PROFILE_TRANSIT = [25, 50]
+SPEED_PROFILE_APPROACH = [5, 0]
+SPEED_PROFILE_PARK = [25, 50]
+# Height above a pickup position the arm moves to at transit speed before the slow final approach
+APPROACH_HEIGHT = 5
+
+# Serial reconnect config, used when the port drops during a session
+SERIAL_RECONNECT_ATTEMPTS = 3
+# Seconds between reconnect attempts
+SERIAL_RECONNECT_DELAY = 1
+# Seconds a blocking read waits for data before checking if the connection is closing
+SERIAL_READ_TIMEOUT = 0.1
+# Seconds the VEX brain has to accept a command before it's resent
+SERIAL_ACK_TIMEOUT = 0.5
+# Times a lost or corrupted command is resent
+SERIAL_COMMAND_RETRIES = 3
+# Seconds an accepted command waits for its DONE before being resent, in case the DONE was lost.
+# The brain answers a resent command with DONE if it's finished, otherwise it's ignored
+SERIAL_DONE_RESEND_INTERVAL = 2.0
+# Commands which can be in flight at once, the VEX brain queues up to 8
+SERIAL_PIPELINE_DEPTH = 4
+# Seconds between checks for data on ports which can't notify the asyncio event loop, i.e. Windows COM ports
+ASYNC_SERIAL_POLL_INTERVAL = 0.005
+
+# VEX brain emulator config, see brain_emulator.py
+# Seconds for a motor to turn one degree at the brain's default velocity
+EMULATOR_SECONDS_PER_DEGREE = 1 / 60
+# Speed of the base, shoulder and elbow motors relative to the default velocity
+EMULATOR_JOINT_SPEEDS = [1.0, 1.0, 1.0]
+# Seconds added before every reply the emulator sends
+EMULATOR_REPLY_DELAY = 0.0
+# Chance of a command being lost before it reaches the emulator, and of a reply being lost
+EMULATOR_COMMAND_DROP_RATE = 0.0
+EMULATOR_REPLY_DROP_RATE = 0.0
+# Turn the joints together like the brain, see CONCURRENT_MOTION in vex/src/main.py
+EMULATOR_CONCURRENT_MOTION = True
+
+# Serial telemetry config, see serial_telemetry.py
+# Number of commands the timing histograms cover
+SERIAL_TELEMETRY_HISTORY = 500
+# Seconds the bytes and commands per second are measured over
+SERIAL_TELEMETRY_WINDOW = 10
+# Histogram bin edges in milliseconds
+SERIAL_TELEMETRY_BINS_MS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000]
+# File the stats are periodically written to, .csv for per command timings otherwise JSON, None to disable
+SERIAL_TELEMETRY_DUMP_PATH = None
+# Seconds between writes of the stats file
+SERIAL_TELEMETRY_DUMP_INTERVAL = 60
+
+# Heartbeat config, the VEX brain sends a heartbeat every interval so a dead link is noticed
+# without waiting for a command to time out. Must match HEARTBEAT_INTERVAL in vex/src/main.py,
+# None if the brain doesn't send heartbeats
+SERIAL_HEARTBEAT_INTERVAL = 0.1
+# Heartbeats missed in a row before the link is considered down
+SERIAL_HEARTBEAT_MISSED_BEATS = 3
+# Seconds the master waits for a link that went down to come back before giving up
+SERIAL_LINK_RECOVERY_TIMEOUT = 30
+
+# Motor state config, the VEX brain streams its measured joint positions every interval. Must
+# match MOTOR_STATE_INTERVAL in vex/src/main.py
+SERIAL_MOTOR_STATE_INTERVAL = 0.05
+# Seconds a motor state is trusted for, older states are ignored when planning
+SERIAL_MOTOR_STATE_MAX_AGE = 0.5
+
+# Vision config
+# "channel" receives camruler's detections as they're published, see detection_channel.py,
+# "csv" reads them from the object log camruler writes every log interval
+OBJECT_SOURCE = "channel"
+# Where camruler publishes detections, must match detection_channel in vision/camruler.py
+DETECTION_CHANNEL_HOST = "127.0.0.1"
+DETECTION_CHANNEL_PORT = 5005
@@ -0,0 +1,162 @@
+import socket, struct, threading, time, config
+from datetime import datetime, timezone
+from collections import namedtuple
+
+# Detections published by vision/camruler.py, which has a copy of these definitions which must
+# be kept in sync.
+#
+# Every processed camera frame is sent as a single UDP datagram to the subscriber on localhost,
+# so a snapshot is always received whole or not at all. Only the latest snapshot matters, a
+# subscriber which isn't listening simply misses them.
+#
+# Datagram layout, little endian:
+# | magic (4) | iteration (4) | capture ns (8) | publish ns (8) | object count (2) | objects |
+# Each object is its mid x, mid y, width, height and area in cm. Times are nanoseconds since the epoch.
+
+MAGIC = b"DET1"
+HEADER = struct.Struct("<4sIqqH")
+OBJECT = struct.Struct("<5f")
+MAX_DATAGRAM = 65507
+MAX_OBJECTS = (MAX_DATAGRAM - HEADER.size) // OBJECT.size
+
+# Object seen by the vision system, timestamp is when the camera frame it was seen in was captured
+DetectedObject = namedtuple("DetectedObject", ["timestamp", "iteration", "mid_x", "mid_y", "width", "height", "area"])
+# received is the subscriber's perf_counter when the snapshot arrived
+DetectionSnapshot = namedtuple("DetectionSnapshot", ["iteration", "capture_ns", "publish_ns", "received", "objects"])
+
+
+def encode_snapshot(iteration: int, capture_ns: int, objects, publish_ns=None) -> bytes:
+    """
+    objects are (mid_x, mid_y, width, height, area) tuples.
+    """
+    if len(objects) > MAX_OBJECTS:
+        raise ValueError(f"A snapshot can have at most {MAX_OBJECTS} objects, got {len(objects)}")
+
+    if publish_ns is None:
+        publish_ns = time.time_ns()
+    data = HEADER.pack(MAGIC, iteration % (1 << 32), capture_ns, publish_ns, len(objects))
+    return data + b"".join(OBJECT.pack(*o) for o in objects)
+
+
+def decode_snapshot(data, received: float) -> DetectionSnapshot:
+    """DetectionSnapshot of a datagram, None if it's malformed."""
+    if len(data) < HEADER.size:
+        return None
+    magic, iteration, capture_ns, publish_ns, count = HEADER.unpack_from(data)
+    if magic != MAGIC or len(data) != HEADER.size + count * OBJECT.size:
+        return None
+
+    timestamp = datetime.fromtimestamp(capture_ns / 1e9, tz=timezone.utc)
+    objects = [DetectedObject(timestamp, iteration, *values) for values in OBJECT.iter_unpack(data[HEADER.size:])]
+    return DetectionSnapshot(iteration, capture_ns, publish_ns, received, objects)
+
+
+class DetectionSubscriber():
+    """
+    Receives camruler's detections on a background thread, keeping only the latest snapshot.
+
+    Listeners added with add_listener are called on the receiving thread with each new snapshot,
+    and wait_for_update blocks until a snapshot captured after a given time arrives.
+    """
+    def __init__(self, host=config.DETECTION_CHANNEL_HOST, port=config.DETECTION_CHANNEL_PORT):
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        # Replaced whole by the receiving thread so it can be read without the lock
+        self.latest = None
+        self.changed = threading.Condition()
+        self.listeners = []
+        self.malformed = 0
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, *_):
+        self.close()
+
+
+    def open(self):
+        if self.socket is not None:
+            return
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((self.host, self.port))
+        # Wakes up regularly to notice when the subscriber is closed
+        self.socket.settimeout(0.1)
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.receive, name="DetectionSubscriber", daemon=True)
+        self.thread.start()
+
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        if self.socket is not None:
+            self.socket.close()
+        self.socket = None
+        self.thread = None
+
+
+    def receive(self):
+        while not self.stop_event.is_set():
+            try:
+                data = self.socket.recv(MAX_DATAGRAM)
+            except socket.timeout:
+                continue
+            except OSError as ex:
+                if not self.stop_event.is_set():
+                    print(f"[Detection Subscriber] Receive failed: {ex}")
+                return
+
+            snapshot = decode_snapshot(data, time.perf_counter())
+            if snapshot is None:
+                self.malformed += 1
+                continue
+
+            with self.changed:
+                self.latest = snapshot
+                self.changed.notify_all()
+            for listener in list(self.listeners):
+                listener(snapshot)
+
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+
+    def wait_for_update(self, after: datetime, timeout: float) -> DetectionSnapshot:
+        """
+        Waits for a snapshot of a camera frame captured after the time, returns None if none
+        arrives within the timeout.
+        """
+        after_ns = int(after.timestamp() * 1e9)
+        with self.changed:
+            is_updated = self.changed.wait_for(lambda: self.latest is not None and self.latest.capture_ns > after_ns, timeout)
+            return self.latest if is_updated else None
+
+
+# Subscriber shared by everything in the process, see get_subscriber
+subscriber = None
+subscriber_lock = threading.Lock()
+
+
+def get_subscriber() -> DetectionSubscriber:
+    global subscriber
+    with subscriber_lock:
+        if subscriber is None:
+            subscriber = DetectionSubscriber()
+            subscriber.open()
+        return subscriber
@@ -0,0 +1,182 @@
+import os, time
+import numpy as np
+import config
+import kinematics
+
+# Slack when matching a query against the edge of the table or a single z level
+AXIS_TOLERANCE = 1e-6
+
+
+class IKTable():
+    """
+    Precomputed inverse kinematics over a grid of the workspace. Each cell holds the joint
+    angles, if the cell is reachable and which elbow solution was used. Queries are answered
+    by interpolating between the surrounding cells.
+
+    Build and save the table by running this file, the ArmModel loads it when IK_SOLVER is "table".
+    """
+    def __init__(self, x_axis, y_axis, z_axis, angles, reachable, elbow_up, dh_params, joint_limits):
+        self.x_axis = x_axis
+        self.y_axis = y_axis
+        self.z_axis = z_axis
+        # [z, y, x, (base, shoulder, elbow)]
+        self.angles = angles
+        # [z, y, x]
+        self.reachable = reachable
+        self.elbow_up = elbow_up
+        self.dh_params = dh_params
+        self.joint_limits = joint_limits
+
+
+    @classmethod
+    def build(cls, x_limit, y_limit, z_levels, step, dh_params=kinematics.DH_PARAMS,
+              joint_limits=config.JOINT_LIMITS, elbow_up=config.IK_ELBOW_UP):
+        """
+        Samples the workspace on a grid and solves every cell in one pass with the analytic solver.
+
+        Parameters
+        ----------
+        x_limit: list
+            [min, max] x coordinate of the workspace.
+        y_limit: list
+            [min, max] y coordinate of the workspace.
+        z_levels: list
+            Heights to sample, queries between two levels are interpolated.
+        step: float
+            Grid spacing on the x and y axes.
+
+        Returns
+        -------
+        table: IKTable
+        """
+        x_axis = np.arange(x_limit[0], x_limit[1] + AXIS_TOLERANCE, step, dtype=np.float64)
+        y_axis = np.arange(y_limit[0], y_limit[1] + AXIS_TOLERANCE, step, dtype=np.float64)
+        z_axis = np.array(sorted(z_levels), dtype=np.float64)
+
+        shape = (len(z_axis), len(y_axis), len(x_axis))
+        z_grid, y_grid, x_grid = np.meshgrid(z_axis, y_axis, x_axis, indexing="ij")
+        points = np.stack((x_grid.ravel(), y_grid.ravel(), z_grid.ravel()), axis=-1)
+
+        solutions = kinematics.solve_analytic_batch(points, dh_params, joint_limits, elbow_up)
+
+        angles = np.stack((solutions["base"], solutions["shoulder"], solutions["elbow"]), axis=-1)
+        angles = angles.astype(np.float32).reshape(shape + (3,))
+        reachable = solutions["reachable"].reshape(shape)
+        is_elbow_up = solutions["elbow_up"].reshape(shape)
+
+        return cls(x_axis, y_axis, z_axis, angles, reachable, is_elbow_up,
+                   np.array(dh_params, dtype=np.float64), np.array(joint_limits, dtype=np.float64))
+
+
+    def save(self, path):
+        # Stored uncompressed so loading is a straight copy of the arrays
+        np.savez(
+            path,
+            x_axis=self.x_axis,
+            y_axis=self.y_axis,
+            z_axis=self.z_axis,
+            angles=self.angles,
+            reachable=self.reachable,
+            elbow_up=self.elbow_up,
+            dh_params=self.dh_params,
+            joint_limits=self.joint_limits)
+
+
+    @classmethod
+    def load(cls, path, dh_params=kinematics.DH_PARAMS, joint_limits=config.JOINT_LIMITS):
+        """
+        Loads a saved table. Returns None if the file doesn't exist or was built for a different
+        arm model or joint limits, in which case the table needs rebuilding.
+        """
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            table = cls(**{key: data[key] for key in data.files})
+
+        if (table.dh_params.shape != np.shape(dh_params)
+                or not np.allclose(table.dh_params, dh_params)
+                or table.joint_limits.shape != np.shape(joint_limits)
+                or not np.allclose(table.joint_limits, joint_limits)):
+            return None
+
+        return table
+
+
+    def lookup(self, x: float, y: float, z: float):
+        """
+        Interpolates the joint angles for the target from the surrounding cells.
+
+        Parameters
+        ----------
+        x: float
+            Target x coordinate.
+        y: float
+            Target y coordinate.
+        z: float
+            Target z coordinate.
+
+        Returns
+        -------
+        solution: tuple or None
+            (reachable, [base, shoulder, elbow]) in degrees. None if the target is outside of the
+            table or the surrounding cells can't be interpolated between, i.e. some are unreachable
+            or use a different elbow solution, so the target must be solved directly.
+        """
+        cells = []
+        for axis, value in ((self.z_axis, z), (self.y_axis, y), (self.x_axis, x)):
+            cell = locate_cell(axis, value)
+            if cell is None:
+                return None
+            cells.append(cell)
+
+        (z0, z1, z_frac), (y0, y1, y_frac), (x0, x1, x_frac) = cells
+        # Slices keep the corners as views instead of copying them out of the table
+        z_slice, y_slice, x_slice = slice(z0, z1 + 1), slice(y0, y1 + 1), slice(x0, x1 + 1)
+
+        reachable = self.reachable[z_slice, y_slice, x_slice]
+        elbow_up = self.elbow_up[z_slice, y_slice, x_slice]
+        if not reachable.all() or elbow_up.any() != elbow_up.all():
+            return None
+
+        corners = self.angles[z_slice, y_slice, x_slice, 1:]
+        # Interpolate along x, then y, then z, a single z level has nothing to interpolate along
+        corners = corners[..., 0, :] * (1 - x_frac) + corners[..., -1, :] * x_frac
+        corners = corners[:, 0] * (1 - y_frac) + corners[:, -1] * y_frac
+        shoulder, elbow = corners[0] * (1 - z_frac) + corners[-1] * z_frac
+
+        # The base angle is exact and interpolating it would break where it wraps behind the arm
+        base = np.degrees(np.arctan2(y, x)) if (x != 0 or y != 0) else 0.
+        return True, [float(base), float(shoulder), float(elbow)]
+
+
+def locate_cell(axis, value):
+    """
+    Finds the two grid indices either side of the value and how far between them it is.
+    Returns None if the value is outside of the axis.
+    """
+    if len(axis) == 1:
+        return (0, 0, 0.) if abs(value - axis[0]) <= AXIS_TOLERANCE else None
+
+    if not axis[0] - AXIS_TOLERANCE <= value <= axis[-1] + AXIS_TOLERANCE:
+        return None
+
+    i = int(np.searchsorted(axis, value, side="right")) - 1
+    i = min(max(i, 0), len(axis) - 2)
+    fraction = (value - axis[i]) / (axis[i + 1] - axis[i])
+    return i, i + 1, min(max(fraction, 0.), 1.)
+
+
+def main():
+    print(f"[IK Table] Building table with {config.IK_TABLE_STEP} step at z levels {config.IK_TABLE_Z_LEVELS}...")
+    start = time.perf_counter()
+    table = IKTable.build(config.X_LIMIT, config.Y_LIMIT, config.IK_TABLE_Z_LEVELS, config.IK_TABLE_STEP)
+    print(f"[IK Table] Solved {table.reachable.size} cells in {time.perf_counter() - start:.2f}s, "
+          f"{int(table.reachable.sum())} reachable")
+
+    table.save(config.IK_TABLE_PATH)
+    print(f"[IK Table] Saved to {config.IK_TABLE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
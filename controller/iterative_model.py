@@ -0,0 +1,22 @@
+# Imported lazily by arm_model.py, visual_kinematics loads matplotlib's plotting machinery on import
+from visual_kinematics.RobotSerial import *
+
+
+class CountingRobotSerial(RobotSerial):
+    """
+    RobotSerial which counts the iterations taken by the numerical inverse solver, each
+    iteration moves the model with a single forward call.
+    """
+    def __init__(self, *args, **kwargs):
+        RobotSerial.__init__(self, *args, **kwargs)
+        self.iterations = 0
+
+
+    def inverse_numerical(self, end_frame):
+        self.iterations = 0
+        return RobotSerial.inverse_numerical(self, end_frame)
+
+
+    def forward(self, theta_x):
+        self.iterations += 1
+        return RobotSerial.forward(self, theta_x)
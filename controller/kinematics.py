@@ -0,0 +1,295 @@
+import math
+import numpy as np
+
+# Denavit-Hartenberg (DH) notation for representation of arm's construction
+# DH modelling file found in /DH/ArmDH.kinbin, used by "Robotic Arm Kinematic GUI - Part of MRPT"
+#              [d, a, alpha, theta]
+DH_PARAMS = [[17.0, 0., 90.0 * math.pi / 180, 0.],
+             [0., 11.5, 0., 3 * math.pi / 180],
+             [0., 11.0, 0., -90.0 * math.pi / 180]]
+
+# The electro magnet hangs straight down from the end frame, see the tool DH in arm_model.py
+TOOL_LENGTH = 7.6
+
+# Numerical slack allowed when deciding if a target sits on the edge of the workspace
+REACH_TOLERANCE = 1e-9
+
+# Result of solving a batch of targets, one record per target with angles in degrees
+SOLUTION_DTYPE = np.dtype([
+    ("reachable", np.bool_),
+    ("elbow_up", np.bool_),
+    ("base", np.float64),
+    ("shoulder", np.float64),
+    ("elbow", np.float64)
+])
+
+
+def solve_analytic_all(x: float, y: float, z: float, dh_params=DH_PARAMS) -> tuple:
+    """
+    Closed-form inverse kinematics for the arm. The arm is a base yaw joint followed by a
+    two link planar chain, so once the base is pointed at the target the remaining problem is
+    solved with the law of cosines.
+
+    Parameters
+    ----------
+    x: float
+        Target x coordinate.
+    y: float
+        Target y coordinate.
+    z: float
+        Target z coordinate.
+    dh_params: list
+        DH parameters of the arm [d, a, alpha, theta] per joint.
+
+    Returns
+    -------
+    solutions: tuple
+        (reachable, [[base, shoulder, elbow], [base, shoulder, elbow]]) the elbow-up solution
+        followed by the elbow-down solution in degrees. If the target is out of reach both
+        solutions are the closest pose, i.e. the arm stretched towards the target.
+    """
+    base_height = dh_params[0][0]
+    upper_length = dh_params[1][1]
+    lower_length = dh_params[2][1]
+    shoulder_offset = dh_params[1][3]
+    elbow_offset = dh_params[2][3]
+
+    # Directly above the base any rotation works, keep the base where it is
+    base = math.atan2(y, x) if (x != 0 or y != 0) else 0.
+    radius = math.hypot(x, y)
+    height = z - base_height
+
+    cos_elbow = ((radius ** 2 + height ** 2 - upper_length ** 2 - lower_length ** 2)
+                 / (2 * upper_length * lower_length))
+    reachable = -1 - REACH_TOLERANCE <= cos_elbow <= 1 + REACH_TOLERANCE
+    cos_elbow = max(-1., min(1., cos_elbow))
+
+    solutions = []
+    # Negative elbow bends the lower link down, which is the elbow-up configuration
+    for elbow in (-math.acos(cos_elbow), math.acos(cos_elbow)):
+        shoulder = math.atan2(height, radius) - math.atan2(
+            lower_length * math.sin(elbow), upper_length + lower_length * math.cos(elbow))
+        solutions.append([
+            wrap_degrees(math.degrees(base)),
+            wrap_degrees(math.degrees(shoulder - shoulder_offset)),
+            wrap_degrees(math.degrees(elbow - elbow_offset))
+        ])
+
+    return reachable, solutions
+
+
+def solve_analytic(x: float, y: float, z: float, dh_params=DH_PARAMS, joint_limits=None, elbow_up=True) -> tuple:
+    """
+    Picks the preferred closed-form solution which is within the joint limits.
+
+    Parameters
+    ----------
+    x: float
+        Target x coordinate.
+    y: float
+        Target y coordinate.
+    z: float
+        Target z coordinate.
+    dh_params: list
+        DH parameters of the arm [d, a, alpha, theta] per joint.
+    joint_limits: list
+        Optional [min, max] degrees for each joint, None skips the check.
+    elbow_up: bool
+        Try the elbow-up solution before the elbow-down solution.
+
+    Returns
+    -------
+    solution: tuple
+        (reachable, [base, shoulder, elbow]) in degrees. Reachable is False if the target is out
+        of reach or neither solution is within the joint limits, the preferred solution is
+        still returned as a best attempt.
+    """
+    reachable, solutions = solve_analytic_all(x, y, z, dh_params)
+    if not elbow_up:
+        solutions.reverse()
+
+    if not reachable:
+        return False, solutions[0]
+
+    for angles in solutions:
+        if within_joint_limits(angles, joint_limits):
+            return True, angles
+
+    return False, solutions[0]
+
+
+def solve_analytic_all_batch(points, dh_params=DH_PARAMS) -> tuple:
+    """
+    Vectorised version of solve_analytic_all, solves every target in a single pass.
+
+    Parameters
+    ----------
+    points: np.ndarray
+        Targets as an array of shape (N, 3) of x, y, z coordinates.
+    dh_params: list
+        DH parameters of the arm [d, a, alpha, theta] per joint.
+
+    Returns
+    -------
+    solutions: tuple
+        (reachable, angles) where reachable has shape (N,) and angles has shape (2, N, 3) holding
+        the elbow-up then elbow-down [base, shoulder, elbow] for each target in degrees.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    x, y, z = points[:, 0], points[:, 1], points[:, 2]
+
+    base_height = dh_params[0][0]
+    upper_length = dh_params[1][1]
+    lower_length = dh_params[2][1]
+    shoulder_offset = dh_params[1][3]
+    elbow_offset = dh_params[2][3]
+
+    # arctan2(0, 0) is 0 so targets directly above the base need no special case
+    base = np.arctan2(y, x)
+    radius = np.hypot(x, y)
+    height = z - base_height
+
+    cos_elbow = ((radius ** 2 + height ** 2 - upper_length ** 2 - lower_length ** 2)
+                 / (2 * upper_length * lower_length))
+    reachable = np.abs(cos_elbow) <= 1 + REACH_TOLERANCE
+
+    # Negative elbow bends the lower link down, which is the elbow-up configuration
+    elbow = np.arccos(np.clip(cos_elbow, -1., 1.)) * np.array([[-1.], [1.]])
+    shoulder = np.arctan2(height, radius) - np.arctan2(
+        lower_length * np.sin(elbow), upper_length + lower_length * np.cos(elbow))
+
+    angles = np.empty((2, len(points), 3), dtype=np.float64)
+    angles[:, :, 0] = base
+    angles[:, :, 1] = shoulder - shoulder_offset
+    angles[:, :, 2] = elbow - elbow_offset
+    return reachable, wrap_degrees_batch(np.degrees(angles))
+
+
+def solve_analytic_batch(points, dh_params=DH_PARAMS, joint_limits=None, elbow_up=True) -> np.ndarray:
+    """
+    Vectorised version of solve_analytic, picks the preferred solution within the joint limits
+    for every target.
+
+    Parameters
+    ----------
+    points: np.ndarray
+        Targets as an array of shape (N, 3) of x, y, z coordinates.
+    dh_params: list
+        DH parameters of the arm [d, a, alpha, theta] per joint.
+    joint_limits: list
+        Optional [min, max] degrees for each joint, None skips the check.
+    elbow_up: bool
+        Try the elbow-up solution before the elbow-down solution.
+
+    Returns
+    -------
+    solutions: np.ndarray
+        Structured array of SOLUTION_DTYPE with shape (N,). Unreachable targets hold the
+        preferred solution as a best attempt.
+    """
+    reachable, angles = solve_analytic_all_batch(points, dh_params)
+    preferred, other = (angles[0], angles[1]) if elbow_up else (angles[1], angles[0])
+
+    preferred_valid = reachable & within_joint_limits_batch(preferred, joint_limits)
+    other_valid = reachable & ~preferred_valid & within_joint_limits_batch(other, joint_limits)
+
+    chosen = np.where(other_valid[:, np.newaxis], other, preferred)
+
+    solutions = np.empty(len(chosen), dtype=SOLUTION_DTYPE)
+    solutions["reachable"] = preferred_valid | other_valid
+    solutions["elbow_up"] = other_valid != elbow_up
+    solutions["base"] = chosen[:, 0]
+    solutions["shoulder"] = chosen[:, 1]
+    solutions["elbow"] = chosen[:, 2]
+    return solutions
+
+
+def forward_batch(joints, dh_params=DH_PARAMS, tool_length=TOOL_LENGTH) -> np.ndarray:
+    """
+    Vectorised forward kinematics, the position of every joint of the arm for many poses at once.
+
+    Parameters
+    ----------
+    joints: np.ndarray
+        Poses as an array of shape (N, 3) of base, shoulder, elbow angles in degrees.
+    dh_params: list
+        DH parameters of the arm [d, a, alpha, theta] per joint.
+    tool_length: float
+        Distance the tool hangs below the end frame.
+
+    Returns
+    -------
+    positions: np.ndarray
+        Array of shape (N, 5, 3), the x, y, z of the base, shoulder, elbow, end frame and
+        tool tip for each pose.
+    """
+    joints = np.radians(np.asarray(joints, dtype=np.float64).reshape(-1, 3))
+    count = len(joints)
+
+    positions = np.zeros((count, len(dh_params) + 2, 3), dtype=np.float64)
+    frame = np.broadcast_to(np.eye(4), (count, 4, 4))
+
+    for i, (d, a, alpha, offset) in enumerate(dh_params):
+        theta = joints[:, i] + offset
+        cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+        cos_alpha, sin_alpha = math.cos(alpha), math.sin(alpha)
+
+        # Standard DH transform Rz(theta) Tz(d) Tx(a) Rx(alpha)
+        transform = np.zeros((count, 4, 4), dtype=np.float64)
+        transform[:, 0, 0] = cos_theta
+        transform[:, 0, 1] = -sin_theta * cos_alpha
+        transform[:, 0, 2] = sin_theta * sin_alpha
+        transform[:, 0, 3] = a * cos_theta
+        transform[:, 1, 0] = sin_theta
+        transform[:, 1, 1] = cos_theta * cos_alpha
+        transform[:, 1, 2] = -cos_theta * sin_alpha
+        transform[:, 1, 3] = a * sin_theta
+        transform[:, 2, 1] = sin_alpha
+        transform[:, 2, 2] = cos_alpha
+        transform[:, 2, 3] = d
+        transform[:, 3, 3] = 1.
+
+        frame = frame @ transform
+        positions[:, i + 1] = frame[:, 0:3, 3]
+
+    # The base is the origin and the first joint's frame sits on the shoulder
+    positions[:, -1] = positions[:, -2] - (0., 0., tool_length)
+    return positions
+
+
+def within_joint_limits_batch(angles, joint_limits) -> np.ndarray:
+    """Checks an array of [base, shoulder, elbow] angles of shape (..., 3) against the joint limits."""
+    angles = np.asarray(angles)
+    if joint_limits is None:
+        return np.ones(angles.shape[:-1], dtype=bool)
+
+    limits = np.asarray(joint_limits, dtype=np.float64)
+    return np.all((angles >= limits[:, 0]) & (angles <= limits[:, 1]), axis=-1)
+
+
+def is_elbow_up(angles, dh_params=DH_PARAMS) -> bool:
+    """True if the [base, shoulder, elbow] degrees bend the lower link down, see solve_analytic_all."""
+    return wrap_degrees(angles[2] + math.degrees(dh_params[2][3])) <= 0
+
+
+def within_joint_limits(angles, joint_limits) -> bool:
+    if joint_limits is None:
+        return True
+
+    return all(low <= angle <= high for angle, (low, high) in zip(angles, joint_limits))
+
+
+def wrap_degrees(angle: float) -> float:
+    """Wraps an angle in degrees to the range (-180, 180]."""
+    angle = math.fmod(angle, 360.)
+    if angle > 180.:
+        angle -= 360.
+    elif angle <= -180.:
+        angle += 360.
+    return angle
+
+
+def wrap_degrees_batch(angles):
+    """Vectorised version of wrap_degrees."""
+    angles = np.mod(angles, 360.)
+    return np.where(angles > 180., angles - 360., angles)
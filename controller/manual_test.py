@@ -5,6 +5,7 @@ import config
 
 def main():
     model = ArmModel(config.X_LIMIT, config.Y_LIMIT, config.Z_LIMIT)
+    serial.get_connection().open()
 
     while True:
         x = 0
@@ -26,7 +27,7 @@ def main():
         shoulder_angle = round(results[2], config.DECIMAL_PLACES)
         elbow_angle = round(results[3], config.DECIMAL_PLACES)
 
-        model.model.show(True, True)
+        model.show(True, True)
         print(results)       
         print(f"{base_angle} {shoulder_angle} {elbow_angle} {is_pickup}")
 
@@ -37,11 +38,15 @@ def main():
         # Hold for user input
         input()
         
-        serial.send_data(f"{base_angle} {shoulder_angle} {elbow_angle} {is_pickup}")
-        response = serial.receive_data()
+        is_done = serial.move(base_angle, shoulder_angle, elbow_angle, is_pickup)
 
-        print(response)
+        print("Done" if is_done else "Timed out")
+        if is_done:
+            print(f"Round trip: {serial.get_connection().last_round_trip:.3f}s")
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        serial.close()
@@ -1,11 +1,18 @@
-import os, csv, threading, time, math, config
+import time
+# Taken before the other imports so the reported start up time includes loading them
+START_TIME = time.perf_counter()
+
+import os, threading, math, config
+import numpy as np
 from datetime import datetime, timezone
-from collections import namedtuple
 from arm_model import ArmModel
 import serial_communication as serial
+import detection_channel
+from detection_channel import DetectedObject
+from protocol import Waypoint, ACTION_NONE, ACTION_PICKUP
 
 
-# Log of objects seen by vision system
+# Log of objects seen by vision system, only read if config.OBJECT_SOURCE is "csv"
 OBJECT_LOG_PATH = os.path.join(os.getcwd(), "object_log.csv") 
 
 # Filtering rules, these are used to ensure that objects detected at least match the expected size, values in CM
@@ -21,6 +28,8 @@ MIN_DIST=10
 FORBIDDEN_Y_RANGE=(-10, 10)
 GRID_STEP=5
 GRID_LIMIT=25
+# Height objects are dropped off at
+DROP_OFF_Z = config.Z_AXIS_TOLERANCE + 5
 
 # Serial communication globals
 VEX_TIMEOUT = 30
@@ -28,47 +37,143 @@ SERIAL_COMM_RETRIES = 3
 
 CAMRULER_TIMEOUT = 30
 
-# CSV data structure, must match camruler.py output to object_log.csv
-DetectedObject = namedtuple("DetectedObject", ["timestamp", "iteration", "mid_x", "mid_y", "width", "height", "area"])
-
 # Shared object store
 objects = []
 tracked_objects = []
 objects_lock = threading.Lock()
 
+def is_valid_object(obj) -> bool:
+    # Only import objects which meet the criteria set above
+    return (
+        MIN_WIDTH <= obj.width <= MAX_WIDTH and
+        MIN_HEIGHT <= obj.height <= MAX_HEIGHT and
+        MIN_AREA <= obj.area <= MAX_AREA
+    )
+
 def read_objects():
-    global OBJECT_LOG_PATH, objects
-    local_objects = []
-    with open(OBJECT_LOG_PATH, newline='') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            obj = DetectedObject(
-                timestamp=datetime.fromisoformat(row["timestamp"]),
-                iteration=row["iteration"],
-                mid_x=float(row["mid_x"]),
-                mid_y=float(row["mid_y"]),
-                width=float(row["width"]),
-                height=float(row["height"]),
-                area=float(row["area"])
-            )
-
-            # Only import objects which meet the criteria set above
-            if (
-                MIN_WIDTH <= obj.width <= MAX_WIDTH and
-                MIN_HEIGHT <= obj.height <= MAX_HEIGHT and
-                MIN_AREA <= obj.area <= MAX_AREA
-            ):
-                local_objects.append(obj)
+    """
+    Latest valid objects seen by the vision system, from config.OBJECT_SOURCE.
+    """
+    if config.OBJECT_SOURCE == "channel":
+        snapshot = detection_channel.get_subscriber().latest
+        if snapshot is None:
+            return []
+        return [obj for obj in snapshot.objects if is_valid_object(obj)]
+    return read_object_log()
+
+def wait_for_objects(after: datetime, timeout: int):
+    """
+    Waits for the valid objects seen in a camera frame after the time, None if the vision system
+    doesn't update within the timeout in seconds.
+    """
+    if config.OBJECT_SOURCE == "channel":
+        snapshot = detection_channel.get_subscriber().wait_for_update(after, timeout)
+        if snapshot is None:
+            return None
+        return [obj for obj in snapshot.objects if is_valid_object(obj)]
+
+    for i in range(timeout):
+        updated_objects = read_objects()
+
+        # Find objects added to object log by camera after movement timestamp
+        if any(o.timestamp > after for o in updated_objects) or len(updated_objects) == 0:
+            return updated_objects
+
+        print(f"[Master] Objects does not have an updated list of detected objects - iteration: {i}")
+        time.sleep(1)
+    return None
+
+# Object log columns parsed into a structured array, see load_object_log
+OBJECT_LOG_DTYPE = np.dtype([
+    ("timestamp_ns", np.int64),
+    ("iteration", np.int64),
+    ("mid_x", np.float64),
+    ("mid_y", np.float64),
+    ("width", np.float64),
+    ("height", np.float64),
+    ("area", np.float64)
+])
+
+def parse_timestamps(values) -> np.ndarray:
+    """
+    Nanoseconds since the epoch of camruler's "%Y-%m-%d %H:%M:%S.%f%z" timestamps, parsed as a column.
+    """
+    # numpy parses the time without its UTC offset, which is taken off afterwards. camruler always
+    # writes UTC so there's nearly always a single offset
+    stamps = np.array([v[:-5] for v in values], dtype="datetime64[ns]").astype(np.int64)
+    offsets = [v[-5:] for v in values]
+    offset_ns = {o: (-1 if o[0] == "-" else 1) * (int(o[1:3]) * 3600 + int(o[3:5]) * 60) * 10**9 for o in set(offsets)}
+    if len(offset_ns) == 1:
+        return stamps - offset_ns[offsets[0]]
+    return stamps - np.array([offset_ns[o] for o in offsets], dtype=np.int64)
+
+def load_object_log(path) -> np.ndarray:
+    """
+    Every object in the object log as a structured array of OBJECT_LOG_DTYPE. Each column is
+    converted in one go rather than row by row, raises ValueError if a value can't be parsed.
+    """
+    # Universal newlines, camruler's csv module ends lines with \r\n
+    with open(path) as f:
+        header, _, body = f.read().partition("\n")
+    header = header.split(",")
+    # A line cut short by reading the log while it's being rewritten is dropped
+    if body and not body.endswith("\n"):
+        body = body[:body.rfind("\n") + 1]
+
+    # Splitting the whole body at once leaves each column every len(header) fields
+    fields = body.replace("\n", ",").split(",")[:-1]
+    rows = body.count("\n")
+    if len(fields) != rows * len(header):
+        # Only if lines have the wrong number of fields, they're dropped
+        lines = [line.split(",") for line in body.splitlines()]
+        fields = [field for line in lines if len(line) == len(header) for field in line]
+        rows = len(fields) // len(header)
+
+    objects = np.empty(rows, OBJECT_LOG_DTYPE)
+    if rows == 0:
+        return objects
+
+    columns = {name: fields[i::len(header)] for i, name in enumerate(header)}
+    objects["timestamp_ns"] = parse_timestamps(columns["timestamp"])
+    objects["iteration"] = np.array(columns["iteration"], dtype=np.int64)
+    for name in ["mid_x", "mid_y", "width", "height", "area"]:
+        objects[name] = np.array(columns[name], dtype=np.float64)
+    return objects
+
+# (modification time, size) of the object log when it was last read and the objects read from it
+object_log_cache = (None, [])
+
+def read_object_log():
+    global OBJECT_LOG_PATH, object_log_cache
+    # camruler only rewrites the log every log interval, most polls find it unchanged
+    stat = os.stat(OBJECT_LOG_PATH)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if object_log_cache[0] == key:
+        return list(object_log_cache[1])
+
+    objects = load_object_log(OBJECT_LOG_PATH)
+
+    # Only import objects which meet the criteria set above
+    valid = (
+        (MIN_WIDTH <= objects["width"]) & (objects["width"] <= MAX_WIDTH) &
+        (MIN_HEIGHT <= objects["height"]) & (objects["height"] <= MAX_HEIGHT) &
+        (MIN_AREA <= objects["area"]) & (objects["area"] <= MAX_AREA)
+    )
+    objects = objects[valid]
 
     # Filter to only latest iteration
-    if local_objects:
-        local_objects.sort(key=lambda o: o.iteration)
-        max_iteration = local_objects[-1].iteration
-        local_objects = [obj for obj in local_objects if obj.iteration == max_iteration]
-    
-    #print(f"[Object Updater Thread] {len(local_objects)} have passed validation and been added to objects")
+    if len(objects):
+        objects = objects[objects["iteration"] == objects["iteration"].max()]
+
+    #print(f"[Object Updater Thread] {len(objects)} have passed validation and been added to objects")
 
-    return local_objects
+    # tolist converts every field to a Python value at once, far quicker than indexing each one
+    local_objects = [
+        DetectedObject(datetime.fromtimestamp(timestamp_ns / 1e9, tz=timezone.utc), iteration, *values)
+        for timestamp_ns, iteration, *values in objects.tolist()
+    ]
+    object_log_cache = (key, local_objects)
+    return list(local_objects)
 
 def decide_target_objects_order(objects):
     if not objects:
@@ -88,15 +193,19 @@ def decide_target_objects_order(objects):
 
     return sorted_objects
 
-def decide_target_objects_destination(objects):
-    global MIN_DIST, FORBIDDEN_Y_RANGE, GRID_STEP, GRID_LIMIT
+def decide_target_objects_destination(objects, arm=None, obstacles=None):
+    # Drop off targets are kept clear of every obstacle, by default the objects being moved. Pass
+    # every detected object as obstacles when only some of them are being moved
+    global MIN_DIST, FORBIDDEN_Y_RANGE, GRID_STEP, GRID_LIMIT, DROP_OFF_Z
     assigned_targets = []
+    if obstacles is None:
+        obstacles = objects
 
     def is_valid_target(tx, ty, obj):
         if FORBIDDEN_Y_RANGE[0] <= ty <= FORBIDDEN_Y_RANGE[1]:
             return False
 
-        for other in objects:
+        for other in obstacles:
             if other is obj:
                 continue
             dist = math.hypot(tx - other.mid_x, ty - other.mid_y)
@@ -116,6 +225,14 @@ def decide_target_objects_destination(objects):
         for y in range(-GRID_LIMIT, GRID_LIMIT + 1, GRID_STEP)
     ]
 
+    # Solve every potential target at once and drop those the arm can't reach safely
+    if arm is not None and potential_targets:
+        points = np.array([(tx, ty, DROP_OFF_Z) for tx, ty in potential_targets], dtype=np.float64)
+        solutions = arm.calc_joint_degrees_batch(points)
+        joints = np.stack((solutions["base"], solutions["shoulder"], solutions["elbow"]), axis=-1)
+        usable = solutions["reachable"] & arm.check_poses(joints)["safe"]
+        potential_targets = [target for target, is_usable in zip(potential_targets, usable) if is_usable]
+
     for obj in objects:
         for tx, ty in potential_targets:
             if is_valid_target(tx, ty, obj):
@@ -126,15 +243,82 @@ def decide_target_objects_destination(objects):
 
     return assigned_targets
 
+def plan_pickup_waypoints(arm, object_x, object_y, pickup_angles, park_angles) -> list:
+    """
+    Waypoints to pick up the object and park, each skipping the neutral pose when going straight
+    there keeps clear of the floor. The arm moves at transit speed to above the object then slowly
+    for the final approach, so only the short descent is slow.
+    """
+    waypoints = []
+    previous_angles = arm.commanded_pose
+
+    joint_angles_approach = arm.calc_joint_degrees(object_x, object_y, config.Z_AXIS_TOLERANCE + config.APPROACH_HEIGHT)
+    if joint_angles_approach[0]:
+        approach_angles = joint_angles_approach[1:]
+        waypoints.append(Waypoint(*approach_angles, ACTION_NONE, arm.is_direct_path_clear(previous_angles, approach_angles),
+                                  *config.SPEED_PROFILE_TRANSIT))
+        previous_angles = approach_angles
+
+    waypoints.append(Waypoint(*pickup_angles, ACTION_PICKUP, arm.is_direct_path_clear(previous_angles, pickup_angles),
+                              *config.SPEED_PROFILE_APPROACH))
+    waypoints.append(Waypoint(*park_angles, ACTION_PICKUP, arm.is_direct_path_clear(pickup_angles, park_angles),
+                              *config.SPEED_PROFILE_PARK))
+    return waypoints
+
+def set_measured_pose(arm, connection):
+    """
+    Called when a move fails and the arm may have stopped anywhere. Plans from the pose the brain
+    last measured if it's recent and the brain is idle, otherwise the pose is unknown. While the
+    brain is still carrying out or has queued the failed command the arm is about to move again.
+    """
+    status = connection.queue_status
+    is_idle = status is not None and status.executing_seq is None and status.depth == 0
+    pose = connection.measured_pose() if is_idle else None
+    if pose is None:
+        arm.set_commanded_pose(None)
+    else:
+        arm.set_commanded_pose(*pose)
+
+def recover_link() -> bool:
+    """
+    Called when a command fails. If the link to the brain went down, waits for it to come back.
+    Returns True if the link recovered and the task can carry on, False if it's still down or the
+    command failed with the link up.
+    """
+    connection = serial.get_connection()
+    if connection.is_link_up:
+        return False
+
+    print("[Master] Lost link to VEX brain, waiting for it to come back...")
+    if not connection.wait_for_link(config.SERIAL_LINK_RECOVERY_TIMEOUT):
+        return False
+
+    print("[Master] Link to VEX brain restored, replanning...")
+    return True
+
 def main():
     print("[Master] Starting task...")
 
     print("[Master] Initialising VEX arm model...")
     arm = ArmModel(config.X_LIMIT, config.Y_LIMIT, config.Z_LIMIT)
+    print(f"[Master] Ready to plan {(time.perf_counter() - START_TIME) * 1000:.0f}ms after start up")
+
+    if config.OBJECT_SOURCE == "channel":
+        print(f"[Master] Subscribing to detections on port {config.DETECTION_CHANNEL_PORT}...")
+        detection_channel.get_subscriber()
+
+    print("[Master] Opening serial connection to VEX...")
+    serial.get_connection().open()
      
     lost_connection = False
     while lost_connection is False:       
-        objects = read_objects()
+        detected_objects = read_objects()
+
+        # Drop objects the arm can't possibly reach before planning for them, they're still in
+        # the way of drop off targets
+        objects = [o for o in detected_objects if arm.is_reachable(o.mid_x, o.mid_y, config.Z_AXIS_TOLERANCE)]
+        if len(objects) != len(detected_objects):
+            print(f"[Master] Skipping {len(detected_objects) - len(objects)} objects out of the arm's reach")
 
         target_objects = decide_target_objects_order(objects)
         if not target_objects:
@@ -142,8 +326,9 @@ def main():
             time.sleep(2)
             continue  # Retry after delay
 
-        destinations = decide_target_objects_destination(target_objects)
+        destinations = decide_target_objects_destination(target_objects, arm, detected_objects)
 
+        replan = False
         for object_x, object_y, destination_x, destination_y in destinations:
             # Skip if no target assigned (fallback behaviour)
             if destination_x is None or destination_y is None:
@@ -161,47 +346,41 @@ def main():
                     is_unreachable = True
                     break
 
-                print("[Master] Sending command to VEX...")
-                # Send command from joint angles and set pickup to be true
-                serial.send_data(f"{joint_angles_pickup[1]} {joint_angles_pickup[2]} {joint_angles_pickup[3]} {True}")
-
-                print(f"[Master] Awaiting vex brain confirmation message...")
-                response = serial.receive_data(VEX_TIMEOUT)
-                if response == "":
-                    print(f"[Master] Timed out while waiting for vex brain to respond, please check that the vex brain is operating correctly")
-                    lost_connection = True
-                    break
-
-                # Send command to Move arm to deadzone to unblock view for camera go to closest facing direction on the x axis
+                # Move arm to deadzone straight after the pickup to unblock view for camera, go to closest facing direction on the x axis
                 if abs(joint_angles_pickup[1]) >= 270 or abs(joint_angles_pickup[1]) <= 90:
-                    serial.send_data(f"{0} {90} {0} {True}")
+                    park_angles = [0, 90, 0]
                 else:
-                    serial.send_data(f"{180} {90} {0} {True}")
+                    park_angles = [180, 90, 0]
+
+                # Pickup and park are sent as one sequence so the brain runs them back to back
+                waypoints = plan_pickup_waypoints(arm, object_x, object_y, joint_angles_pickup[1:], park_angles)
 
+                print("[Master] Sending pickup sequence to VEX...")
                 print(f"[Master] Awaiting vex brain confirmation message...")
-                response = serial.receive_data(VEX_TIMEOUT)
-                if response == "":
+                is_done = serial.move_sequence(
+                    waypoints,
+                    VEX_TIMEOUT * len(waypoints),
+                    lambda index: print(f"[Master] VEX brain reached waypoint {index + 1} of {len(waypoints)}"))
+                if not is_done:
+                    # The arm may have stopped anywhere, so plan again from fresh detections
+                    is_recovered = recover_link()
+                    set_measured_pose(arm, serial.get_connection())
+                    if is_recovered:
+                        replan = True
+                        break
                     print(f"[Master] Timed out while waiting for vex brain to respond, please check that the vex brain is operating correctly")
                     lost_connection = True
                     break
+                arm.set_commanded_pose(*park_angles)
+                print(f"[Master] VEX brain responded in {serial.get_connection().last_round_trip:.2f}s")
 
                 current_timestamp = datetime.now(tz=timezone.utc)
 
                 print("[Master] Waiting for object list update after movement...")
-                updated = False
-                for i in range(CAMRULER_TIMEOUT):
-                    updated_objects = read_objects()
+                updated_objects = wait_for_objects(current_timestamp, CAMRULER_TIMEOUT)
 
-                    # Find objects added to object log by camera after movement timestamp
-                    if any(o.timestamp > current_timestamp for o in updated_objects) or len(updated_objects) == 0:
-                        updated = True
-                        break
-
-                    print(f"[Master] Objects does not have an updated list of detected objects - iteration: {i}")
-                    time.sleep(1)
-
-                if updated is False:
-                    #serial.send_data("Object list never updated")
+                if updated_objects is None:
+                    #serial.alarm("Object list never updated")
                     raise TimeoutError("Object list never updated")    
             
                 # Check for any object near target origin — assume pickup succeeded if none are near
@@ -219,24 +398,34 @@ def main():
                 if is_picked_up:
                     print(f"[Master] No objects still near origin, pickup succeeded...")
 
+            if lost_connection or replan:
+                break
+
             if is_unreachable:
                 print("[MASTER] Unreachable object, skipping to next object...")
                 continue
 
             print("[MASTER] calculating drop off joint angles...")
-            joint_angles_dropoff = arm.calc_joint_degrees(0, 13, config.Z_AXIS_TOLERANCE + 5)
+            joint_angles_dropoff = arm.calc_joint_degrees(0, 13, DROP_OFF_Z)
 
             if not joint_angles_dropoff[0]:
                 print(f"[Master] Drop off position ({destination_x}, {destination_y}) is unreachable")
                 continue
 
-            serial.send_data(f"{joint_angles_dropoff[1]} {joint_angles_dropoff[2]} {joint_angles_dropoff[3]} {False}")
             print(f"[Master] Awaiting vex brain confirmation message...")
-            response = serial.receive_data(VEX_TIMEOUT)
-            if response == "":
+            is_direct = arm.is_direct_path_clear(arm.commanded_pose, joint_angles_dropoff[1:])
+            is_done = serial.move(joint_angles_dropoff[1], joint_angles_dropoff[2], joint_angles_dropoff[3], False, VEX_TIMEOUT,
+                                  is_direct, config.SPEED_PROFILE_TRANSIT)
+            if not is_done:
+                is_recovered = recover_link()
+                set_measured_pose(arm, serial.get_connection())
+                if is_recovered:
+                    replan = True
+                    break
                 print(f"[Master] Timed out while waiting for vex brain to respond, please check that the vex brain is operating correctly")
                 lost_connection = True
                 break
+            arm.set_commanded_pose(*joint_angles_dropoff[1:])
 
             # Short cool down between actions
             time.sleep(1)
@@ -244,4 +433,7 @@ def main():
         time.sleep(1)
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        serial.close()
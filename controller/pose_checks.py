@@ -0,0 +1,116 @@
+import numpy as np
+import config
+import kinematics
+
+# Result of checking a batch of poses, one record per pose
+POSE_CHECK_DTYPE = np.dtype([
+    ("within_limits", np.bool_),
+    ("floor_clear", np.bool_),
+    ("view_clear", np.bool_),
+    ("safe", np.bool_)
+])
+
+# Points sampled along each link when checking if the arm is in the camera's view
+LINK_SAMPLES = 5
+
+
+def check_poses(joints, dh_params=kinematics.DH_PARAMS, joint_limits=config.JOINT_LIMITS,
+                floor_z=config.Z_LIMIT[0], floor_clearance=config.FLOOR_CLEARANCE) -> np.ndarray:
+    """
+    Checks many poses at once for joint limits, hitting the floor and blocking the camera.
+
+    Parameters
+    ----------
+    joints: np.ndarray
+        Poses as an array of shape (N, 3) of base, shoulder, elbow angles in degrees.
+    dh_params: list
+        DH parameters of the arm [d, a, alpha, theta] per joint.
+    joint_limits: list
+        Optional [min, max] degrees for each joint, None skips the check.
+    floor_z: float
+        Height of the workspace floor.
+    floor_clearance: float
+        Minimum height of the elbow and end frame above the floor, the tool only has to stay
+        above the floor itself as it is meant to touch objects.
+
+    Returns
+    -------
+    checks: np.ndarray
+        Structured array of POSE_CHECK_DTYPE with shape (N,). A pose is safe if it's within the
+        joint limits and clear of the floor, being in the camera's view is reported separately
+        as every pickup pose is.
+    """
+    joints = np.asarray(joints, dtype=np.float64).reshape(-1, 3)
+    positions = kinematics.forward_batch(joints, dh_params)
+
+    checks = np.empty(len(joints), dtype=POSE_CHECK_DTYPE)
+    checks["within_limits"] = kinematics.within_joint_limits_batch(joints, joint_limits)
+    # Links are straight so they are above the floor if both of their ends are
+    checks["floor_clear"] = (
+        np.all(positions[:, 2:-1, 2] >= floor_z + floor_clearance, axis=1)
+        & (positions[:, -1, 2] >= floor_z))
+    checks["view_clear"] = ~in_camera_view(positions)
+    checks["safe"] = checks["within_limits"] & checks["floor_clear"]
+    return checks
+
+
+def is_direct_path_clear(start, end, dh_params=kinematics.DH_PARAMS, samples=config.DIRECT_PATH_SAMPLES,
+                         floor_z=config.Z_LIMIT[0], floor_clearance=config.FLOOR_CLEARANCE) -> bool:
+    """
+    Checks if moving every joint together from the start to the end pose keeps the arm clear of
+    the floor, in which case the brain can skip the neutral pose. The brain scales each joint's
+    velocity so they arrive together, so the joints follow a straight line between the poses.
+
+    Parameters
+    ----------
+    start: list
+        Base, shoulder, elbow angles in degrees the arm is moving from.
+    end: list
+        Base, shoulder, elbow angles in degrees the arm is moving to.
+    samples: int
+        Poses checked along the path, including the start and end.
+
+    Returns
+    -------
+    clear: bool
+    """
+    start = np.asarray(start, dtype=np.float64)
+    end = np.asarray(end, dtype=np.float64)
+    fractions = np.linspace(0., 1., max(2, samples))[:, np.newaxis]
+    path = start + (end - start) * fractions
+
+    checks = check_poses(path, dh_params, None, floor_z, floor_clearance)
+    return bool(np.all(checks["floor_clear"]))
+
+
+def in_camera_view(positions, camera_height=config.CAMERA_HEIGHT, x_limit=config.X_LIMIT,
+                   y_limit=config.Y_LIMIT, dead_zone_y=config.CAMERA_DEAD_ZONE_Y) -> np.ndarray:
+    """
+    Checks if any part of the arm hides part of the workspace from the camera, outside of the
+    dead zone.
+
+    Parameters
+    ----------
+    positions: np.ndarray
+        Joint positions from kinematics.forward_batch of shape (N, joints, 3).
+
+    Returns
+    -------
+    in_view: np.ndarray
+        Boolean array of shape (N,), True if the arm blocks the camera.
+    """
+    # Sample along each link from the shoulder to the tool tip
+    fractions = np.linspace(0., 1., LINK_SAMPLES)[:, np.newaxis]
+    starts, ends = positions[:, 1:-1, np.newaxis], positions[:, 2:, np.newaxis]
+    points = (starts + (ends - starts) * fractions).reshape(len(positions), -1, 3)
+
+    # Project each point from the camera down onto the floor to find what it hides
+    height = np.minimum(points[..., 2], camera_height - 1e-6)
+    scale = camera_height / (camera_height - height)
+    floor_x, floor_y = points[..., 0] * scale, points[..., 1] * scale
+
+    hides_workspace = (
+        (floor_x >= x_limit[0]) & (floor_x <= x_limit[1])
+        & (floor_y >= y_limit[0]) & (floor_y <= y_limit[1])
+        & ((floor_y < dead_zone_y[0]) | (floor_y > dead_zone_y[1])))
+    return np.any(hides_workspace, axis=1)
@@ -0,0 +1,280 @@
+import random, struct
+from collections import namedtuple
+
+# Framed binary protocol between the controller and the VEX brain, vex/src/main.py has a copy
+# of these definitions which must be kept in sync.
+#
+# Frame layout, little endian:
+# | sync (2) | type (1) | sequence (2) | payload length (1) | payload (0-255) | CRC-16 (2) |
+#
+# The CRC covers everything between the sync bytes and the CRC. Every command is answered with
+# an ACK of ACCEPTED as soon as it's received, then an ACK of DONE once it has been carried out.
+# Both echo the command's sequence number. A command which arrives corrupted is answered with a NACK.
+# If the arm doesn't reach a position, i.e. a joint stalls and the move times out, the command is
+# answered with an ACK of FAILED in place of DONE and so is every command queued behind it.
+# A SEQUENCE command also reports a PROGRESS frame as each of its waypoints is reached.
+#
+# The brain also sends a HEARTBEAT frame every heartbeat interval whether it's busy or not, its
+# sequence number counts the heartbeats sent. Missing a few in a row means the link is down.
+#
+# Moves are queued on the brain and carried out in order, so the next can be sent while the
+# current one runs. They're ACCEPTED once queued, a full queue is answered with a NACK of
+# QUEUE_FULL. The brain sends a QUEUE_STATUS frame whenever its queue changes, echoing the
+# sequence number of the command being carried out or 0 if it's idle.
+#
+# The brain streams a MOTOR_STATE frame every motor state interval with the measured joint
+# positions, velocities and motor currents and the magnet's state, its sequence number counts
+# the frames sent.
+
+SYNC = b"\xa5\x5a"
+HEADER = struct.Struct("<BHB")
+CRC = struct.Struct("<H")
+FRAME_OVERHEAD = len(SYNC) + HEADER.size + CRC.size
+MAX_PAYLOAD = 255
+SEQUENCE_MODULO = 1 << 16
+
+# Command types, controller to brain
+MOVE = 0x01
+ALARM = 0x02
+SEQUENCE = 0x03
+
+# Reply types, brain to controller
+ACK = 0x80
+NACK = 0x81
+PROGRESS = 0x82
+HEARTBEAT = 0x83
+QUEUE_STATUS = 0x84
+MOTOR_STATE = 0x85
+
+# ACK statuses
+ACCEPTED = 0
+DONE = 1
+FAILED = 2
+
+# NACK statuses
+BAD_CRC = 1
+UNKNOWN_TYPE = 2
+BAD_PAYLOAD = 3
+QUEUE_FULL = 4
+
+# MOVE payload, base, shoulder and elbow degrees, flags, then the speed profile's velocity percent
+# and acceleration percent per second. A velocity of 0 uses the brain's default velocity and an
+# acceleration of 0 starts at full velocity
+MOVE_PAYLOAD = struct.Struct("<fffBBB")
+FLAG_PICKUP = 0x01
+# Go straight to the pose with every joint moving together, skipping the neutral pose. Only set
+# once the controller has checked the direct path stays clear of the floor
+FLAG_DIRECT = 0x02
+
+# SEQUENCE payload, number of waypoints then each waypoint's base, shoulder and elbow degrees,
+# the magnet action carried out with it and its speed profile as MOVE
+SEQUENCE_HEADER = struct.Struct("<B")
+WAYPOINT = struct.Struct("<fffBBB")
+MAX_WAYPOINTS = (MAX_PAYLOAD - SEQUENCE_HEADER.size) // WAYPOINT.size
+
+# Waypoint magnet actions
+ACTION_NONE = 0
+# Magnet on before moving
+ACTION_PICKUP = 1
+# Magnet released after moving
+ACTION_DROP = 2
+# Set in the action byte to move to the waypoint directly, see FLAG_DIRECT
+WAYPOINT_DIRECT = 0x80
+
+STATUS_PAYLOAD = struct.Struct("<B")
+# PROGRESS payload, index of the waypoint reached
+PROGRESS_PAYLOAD = struct.Struct("<B")
+# QUEUE_STATUS payload, commands waiting in the brain's queue then the queue's capacity
+QUEUE_STATUS_PAYLOAD = struct.Struct("<BB")
+# MOTOR_STATE payload, brain timer milliseconds, then base, shoulder and elbow degrees, degrees
+# per second and motor amps, then 1 if the magnet is holding. Joint degrees, i.e. the shoulder's
+# gear ratio is already taken out
+MOTOR_STATE_PAYLOAD = struct.Struct("<I3f3f3fB")
+
+Frame = namedtuple("Frame", ["type", "seq", "payload"])
+QueueStatus = namedtuple("QueueStatus", ["executing_seq", "depth", "capacity"])
+# received is the controller's perf_counter when the frame arrived
+MotorState = namedtuple("MotorState", ["seq", "brain_time_ms", "positions", "velocities", "currents",
+                                       "magnet_on", "received"])
+Waypoint = namedtuple("Waypoint", ["base", "shoulder", "elbow", "action", "direct", "velocity", "acceleration"],
+                      defaults=[False, 0, 0])
+
+
+def crc16(data, crc=0xFFFF) -> int:
+    """CRC-16/CCITT-FALSE of the data."""
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def is_reply_to(frame: Frame, seq: int) -> bool:
+    """
+    True for an ACK or PROGRESS echoing the sequence number, or any NACK as a corrupted command
+    may not have had a readable sequence number.
+    """
+    return frame.type == NACK or (frame.type in (ACK, PROGRESS) and frame.seq == seq)
+
+
+def first_seq() -> int:
+    """
+    Sequence number a connection starts from. The brain recognises the last few sequence numbers
+    it carried out as resends, so a new connection starting from the same number as the last one
+    would have its first commands answered as done without moving. Starting at random makes that
+    as unlikely as the brain's done history is small compared to SEQUENCE_MODULO.
+    """
+    return random.randrange(1, SEQUENCE_MODULO)
+
+
+def next_seq(seq: int) -> int:
+    """Sequence number after seq, skipping 0 which QUEUE_STATUS uses for an idle brain."""
+    return seq % (SEQUENCE_MODULO - 1) + 1
+
+
+def encode_frame(frame_type: int, seq: int, payload=b"") -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(payload)} bytes is larger than {MAX_PAYLOAD}")
+
+    body = HEADER.pack(frame_type, seq % SEQUENCE_MODULO, len(payload)) + bytes(payload)
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+def encode_profile(velocity, acceleration) -> tuple:
+    """Speed profile rounded and clamped to what fits in the payload."""
+    return min(100, max(0, round(velocity))), min(255, max(0, round(acceleration)))
+
+
+def encode_move(angles, pickup: bool, direct=False, profile=None) -> bytes:
+    """
+    profile is [velocity percent, acceleration percent per second], None for the brain's default.
+    """
+    flags = (FLAG_PICKUP if pickup else 0) | (FLAG_DIRECT if direct else 0)
+    velocity, acceleration = encode_profile(*profile) if profile is not None else (0, 0)
+    return MOVE_PAYLOAD.pack(angles[0], angles[1], angles[2], flags, velocity, acceleration)
+
+
+def decode_move(payload) -> Waypoint:
+    """
+    Returns a MOVE payload as a Waypoint with the magnet action of a pickup or drop move.
+    """
+    base, shoulder, elbow, flags, velocity, acceleration = MOVE_PAYLOAD.unpack(payload)
+    action = ACTION_PICKUP if flags & FLAG_PICKUP else ACTION_DROP
+    return Waypoint(base, shoulder, elbow, action, bool(flags & FLAG_DIRECT), velocity, acceleration)
+
+
+def encode_sequence(waypoints) -> bytes:
+    if not 0 < len(waypoints) <= MAX_WAYPOINTS:
+        raise ValueError(f"A sequence must have between 1 and {MAX_WAYPOINTS} waypoints, got {len(waypoints)}")
+
+    payload = SEQUENCE_HEADER.pack(len(waypoints))
+    for waypoint in waypoints:
+        action = waypoint.action | (WAYPOINT_DIRECT if waypoint.direct else 0)
+        velocity, acceleration = encode_profile(waypoint.velocity, waypoint.acceleration)
+        payload += WAYPOINT.pack(waypoint.base, waypoint.shoulder, waypoint.elbow, action, velocity, acceleration)
+    return payload
+
+
+def decode_sequence(payload) -> list:
+    """Returns the list of Waypoints in a SEQUENCE payload, raises ValueError if it's malformed."""
+    if len(payload) < SEQUENCE_HEADER.size:
+        raise ValueError("Sequence payload is empty")
+
+    (count,) = SEQUENCE_HEADER.unpack_from(payload)
+    if len(payload) != SEQUENCE_HEADER.size + count * WAYPOINT.size:
+        raise ValueError("Sequence payload length doesn't match its waypoint count")
+
+    waypoints = []
+    for i in range(count):
+        base, shoulder, elbow, action, velocity, acceleration = WAYPOINT.unpack_from(
+            payload, SEQUENCE_HEADER.size + i * WAYPOINT.size)
+        waypoints.append(Waypoint(base, shoulder, elbow, action & ~WAYPOINT_DIRECT, bool(action & WAYPOINT_DIRECT),
+                                  velocity, acceleration))
+    return waypoints
+
+
+def decode_progress(payload) -> int:
+    """Index of the waypoint reached, None if the payload is malformed."""
+    if len(payload) != PROGRESS_PAYLOAD.size:
+        return None
+    return PROGRESS_PAYLOAD.unpack(payload)[0]
+
+
+def encode_queue_status(depth: int, capacity: int) -> bytes:
+    return QUEUE_STATUS_PAYLOAD.pack(depth, capacity)
+
+
+def decode_queue_status(frame: Frame) -> QueueStatus:
+    """QueueStatus of a QUEUE_STATUS frame, None if the payload is malformed."""
+    if len(frame.payload) != QUEUE_STATUS_PAYLOAD.size:
+        return None
+    depth, capacity = QUEUE_STATUS_PAYLOAD.unpack(frame.payload)
+    return QueueStatus(frame.seq if frame.seq != 0 else None, depth, capacity)
+
+
+def encode_motor_state(brain_time_ms: int, positions, velocities, currents, magnet_on: bool) -> bytes:
+    return MOTOR_STATE_PAYLOAD.pack(brain_time_ms % (1 << 32), *positions, *velocities, *currents, int(magnet_on))
+
+
+def decode_motor_state(frame: Frame, received: float) -> MotorState:
+    """MotorState of a MOTOR_STATE frame, None if the payload is malformed."""
+    if len(frame.payload) != MOTOR_STATE_PAYLOAD.size:
+        return None
+    values = MOTOR_STATE_PAYLOAD.unpack(frame.payload)
+    return MotorState(frame.seq, values[0], values[1:4], values[4:7], values[7:10], bool(values[10]), received)
+
+
+def encode_status(status: int) -> bytes:
+    return STATUS_PAYLOAD.pack(status)
+
+
+def decode_status(payload) -> int:
+    """Status of an ACK or NACK, None if the payload is malformed."""
+    if len(payload) != STATUS_PAYLOAD.size:
+        return None
+    return STATUS_PAYLOAD.unpack(payload)[0]
+
+
+class FrameDecoder():
+    """
+    Incremental frame decoder. Bytes are fed in as they arrive from the port and complete frames
+    are returned. Corrupted frames are counted and skipped, decoding resumes at the next sync.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.corrupted = 0
+
+
+    def feed(self, data) -> list:
+        self.buffer += data
+        frames = []
+
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # Keep a trailing byte in case it's the start of a sync split across reads
+                del self.buffer[:max(0, len(self.buffer) - 1)]
+                return frames
+            del self.buffer[:start]
+
+            if len(self.buffer) < len(SYNC) + HEADER.size:
+                return frames
+
+            frame_type, seq, length = HEADER.unpack_from(self.buffer, len(SYNC))
+            size = FRAME_OVERHEAD + length
+            if len(self.buffer) < size:
+                return frames
+
+            body = bytes(self.buffer[len(SYNC):size - CRC.size])
+            (crc,) = CRC.unpack_from(self.buffer, size - CRC.size)
+            if crc != crc16(body):
+                # Only skip the sync, the real start of the next frame may be inside this one
+                self.corrupted += 1
+                del self.buffer[:len(SYNC)]
+                continue
+
+            del self.buffer[:size]
+            frames.append(Frame(frame_type, seq, body[HEADER.size:]))
@@ -0,0 +1,93 @@
+import math
+import numpy as np
+import kinematics
+
+
+class ReachabilityMap():
+    """
+    Bitmap of the positions the arm can reach. The base rotates the rest of the arm around the z
+    axis so reachability only depends on the distance from the base axis and the height,
+    the map covers the full reach of the arm in that plane.
+
+    Cells are marked reachable if any of their corners are, so targets are never wrongly rejected
+    and only those near the edge of the workspace need the full solve to decide.
+    """
+    def __init__(self, z_origin, resolution, cells, base_limits):
+        self.z_origin = z_origin
+        self.resolution = resolution
+        # [radius, z]
+        self.cells = cells
+        self.base_limits = base_limits
+
+
+    @classmethod
+    def build(cls, dh_params=kinematics.DH_PARAMS, joint_limits=None, resolution=0.25):
+        """
+        Solves a grid over the arms reach in one pass with the analytic solver.
+
+        Parameters
+        ----------
+        dh_params: list
+            DH parameters of the arm [d, a, alpha, theta] per joint.
+        joint_limits: list
+            Optional [min, max] degrees for each joint, None skips the check.
+        resolution: float
+            Grid spacing on the radius and z axes.
+
+        Returns
+        -------
+        map: ReachabilityMap
+        """
+        base_height = dh_params[0][0]
+        reach = dh_params[1][1] + dh_params[2][1]
+
+        # One extra node past the reach so the outer cells have all their corners
+        radius_axis = np.arange(0, reach + 2 * resolution, resolution)
+        z_axis = np.arange(base_height - reach - resolution, base_height + reach + 2 * resolution, resolution)
+
+        radius_grid, z_grid = np.meshgrid(radius_axis, z_axis, indexing="ij")
+        points = np.stack((radius_grid.ravel(), np.zeros(radius_grid.size), z_grid.ravel()), axis=-1)
+
+        # Solved in the base's x axis plane so only the shoulder and elbow limits apply here
+        shoulder_elbow_limits = None if joint_limits is None else [[-180, 180]] + list(joint_limits[1:])
+        solutions = kinematics.solve_analytic_batch(points, dh_params, shoulder_elbow_limits)
+        nodes = solutions["reachable"].reshape(radius_grid.shape)
+
+        cells = nodes[:-1, :-1] | nodes[1:, :-1] | nodes[:-1, 1:] | nodes[1:, 1:]
+        base_limits = None if joint_limits is None else list(joint_limits[0])
+        return cls(float(z_axis[0]), resolution, cells, base_limits)
+
+
+    def is_reachable(self, x: float, y: float, z: float) -> bool:
+        """
+        Returns False if the target definitely can't be reached. True means it may be reachable
+        and the target should be solved to be certain.
+        """
+        i = int(math.hypot(x, y) / self.resolution)
+        j = math.floor((z - self.z_origin) / self.resolution)
+        if i >= self.cells.shape[0] or not 0 <= j < self.cells.shape[1]:
+            return False
+
+        if self.base_limits is not None and (x != 0 or y != 0):
+            base = math.degrees(math.atan2(y, x))
+            if not self.base_limits[0] <= base <= self.base_limits[1]:
+                return False
+
+        return bool(self.cells[i, j])
+
+
+    def is_reachable_batch(self, points) -> np.ndarray:
+        """Vectorised version of is_reachable for an array of targets of shape (N, 3)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        i = (np.hypot(points[:, 0], points[:, 1]) / self.resolution).astype(np.int64)
+        j = np.floor((points[:, 2] - self.z_origin) / self.resolution).astype(np.int64)
+
+        inside = (i < self.cells.shape[0]) & (j >= 0) & (j < self.cells.shape[1])
+        reachable = np.zeros(len(points), dtype=bool)
+        reachable[inside] = self.cells[i[inside], j[inside]]
+
+        if self.base_limits is not None:
+            base = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+            reachable &= (base >= self.base_limits[0]) & (base <= self.base_limits[1])
+
+        return reachable
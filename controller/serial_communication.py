@@ -1,27 +1,585 @@
-import serial, time, config
-
-
-def send_data(data: str):
-    data += "\r\n"
-
-    ser = serial.Serial(config.SERIAL_PORT, config.SERIAL_BAUDRATE)
-    
-    if ser.is_open:
-        ser.write(data.encode())
-        ser.close()
-
-
-def receive_data(timeout=20) -> str:
-    ser = serial.Serial(config.SERIAL_PORT, config.SERIAL_BAUDRATE)
-    
-    if not ser.is_open:
-        return ""
-    
-    for i in range(timeout):
-        size = ser.inWaiting()
-        if size != 0:
-            data = ser.read(size)
-            return data.decode()
+import serial, threading, time, queue, config
+import protocol
+from serial_telemetry import SerialTelemetry
+
+
+class PendingCommand():
+    """
+    A command sent to the brain and not yet done, see SerialConnection.submit. The reader thread
+    routes the brain's replies to it by sequence number.
+    """
+    def __init__(self, frame_type: int, seq: int, data: bytes, timing, on_progress=None):
+        self.frame_type = frame_type
+        self.seq = seq
+        # Encoded frame, resent as is
+        self.data = data
+        self.timing = timing
+        self.on_progress = on_progress
+        self.replies = queue.Queue()
+        self.accepted = False
+
+    @property
+    def start(self) -> float:
+        return self.timing.send
+
+
+class SerialConnection():
+    """
+    Long lived connection to the VEX brain. The port is opened once per session rather than
+    for every message, and is reopened automatically if it drops. Sending and receiving are
+    thread safe and can happen at the same time from different threads.
+
+    A background reader thread blocks on the port and hands each protocol frame from the brain
+    to the command it replies to as soon as it arrives, see protocol.py. The brain queues moves,
+    so up to config.SERIAL_PIPELINE_DEPTH commands can be in flight with the next sent while the
+    current one runs, see submit.
+
+    The reader thread also watches the brain's heartbeats. If nothing is heard from the brain for
+    config.SERIAL_HEARTBEAT_MISSED_BEATS heartbeat intervals the link is marked down, commands in
+    flight fail straight away and the port is reopened until the brain is heard from again.
+    """
+    def __init__(self, port=config.SERIAL_PORT, baudrate=config.SERIAL_BAUDRATE,
+                 reconnect_attempts=config.SERIAL_RECONNECT_ATTEMPTS,
+                 reconnect_delay=config.SERIAL_RECONNECT_DELAY):
+        self.port = port
+        self.baudrate = baudrate
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+
+        self.serial = None
+        # Held while opening or closing the port
+        self.connection_lock = threading.RLock()
+        self.write_lock = threading.Lock()
+
+        self.decoder = protocol.FrameDecoder()
+        self.reader_thread = None
+        self.reader_stop = threading.Event()
+
+        # Commands in flight by sequence number
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.pipeline = threading.Semaphore(config.SERIAL_PIPELINE_DEPTH)
+        # Held until a command is accepted so the brain queues commands in the order they're submitted
+        self.submit_lock = threading.Lock()
+        self.seq = protocol.first_seq()
+        # Latest protocol.QueueStatus reported by the brain
+        self.queue_status = None
+        # Latest protocol.MotorState streamed by the brain. Only the reader thread replaces it and
+        # the tuple is immutable, so it's read without a lock, see measured_pose
+        self.motor_state = None
+
+        # Seconds between sending the last command and it being accepted, and being done
+        self.last_accept_latency = None
+        self.last_round_trip = None
+        self.telemetry = SerialTelemetry()
+
+        # Seconds without hearing from the brain before the link is down, None if the brain
+        # doesn't send heartbeats
+        if config.SERIAL_HEARTBEAT_INTERVAL is None:
+            self.link_timeout = None
         else:
-            time.sleep(1)
-    return ""
+            self.link_timeout = config.SERIAL_HEARTBEAT_INTERVAL * config.SERIAL_HEARTBEAT_MISSED_BEATS
+        self.link_up = threading.Event()
+        self.last_heard = None
+        self.last_link_reconnect = None
+        self.last_heartbeat_seq = None
+        self.missed_heartbeats = 0
+
+
+    def __enter__(self):
+        self.open()
+        return self
+
+
+    def __exit__(self, *_):
+        self.close()
+
+
+    @property
+    def is_open(self) -> bool:
+        return self.serial is not None and self.serial.is_open
+
+
+    def open(self):
+        with self.connection_lock:
+            if not self.is_open:
+                self.open_port()
+                # The brain has until the first heartbeats are due to be heard from
+                self.last_heard = time.perf_counter()
+                self.link_up.set()
+
+            if self.reader_thread is None or not self.reader_thread.is_alive():
+                self.reader_stop.clear()
+                self.reader_thread = threading.Thread(target=self.read_frames, name="SerialReader", daemon=True)
+                self.reader_thread.start()
+
+
+    def open_port(self):
+        # The read timeout lets the reader thread notice when it's asked to stop
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=config.SERIAL_READ_TIMEOUT)
+
+
+    def close(self):
+        with self.connection_lock:
+            self.reader_stop.set()
+            reader_thread = self.reader_thread
+            self.reader_thread = None
+            self.close_port()
+
+        if reader_thread is not None and reader_thread is not threading.current_thread():
+            reader_thread.join()
+
+
+    def close_port(self):
+        with self.connection_lock:
+            if self.serial is not None:
+                try:
+                    self.serial.close()
+                finally:
+                    self.serial = None
+
+
+    def reconnect(self):
+        """
+        Closes and reopens the port, retrying up to reconnect_attempts times.
+        Raises the last serial.SerialException if the port never opens.
+        """
+        with self.connection_lock:
+            self.close_port()
+            for attempt in range(self.reconnect_attempts):
+                try:
+                    self.open_port()
+                    print(f"[Serial] Reconnected to {self.port}")
+                    return
+                except serial.SerialException as ex:
+                    print(f"[Serial] Reconnect attempt {attempt + 1} to {self.port} failed: {ex}")
+                    if attempt + 1 == self.reconnect_attempts:
+                        raise
+                    time.sleep(self.reconnect_delay)
+
+
+    def read_frames(self):
+        """
+        Reader thread, blocks on the port and dispatches every complete frame as it arrives.
+        """
+        while not self.reader_stop.is_set():
+            try:
+                port = self.serial
+                if port is None:
+                    raise serial.SerialException("Port closed")
+
+                # Blocks until at least a byte arrives or the read timeout passes
+                data = port.read(max(1, port.in_waiting))
+                if data:
+                    self.last_heard = time.perf_counter()
+                self.check_link()
+            except (serial.SerialException, OSError, TypeError, AttributeError):
+                if self.reader_stop.is_set():
+                    break
+                try:
+                    self.reconnect()
+                except serial.SerialException:
+                    time.sleep(self.reconnect_delay)
+                self.decoder = protocol.FrameDecoder()
+                continue
+
+            if not data:
+                # Keeps the stats dumped while the brain is silent
+                self.telemetry.check_dump()
+                continue
+            self.telemetry.on_receive(len(data))
+
+            for frame in self.decoder.feed(data):
+                self.dispatch(frame)
+
+
+    def dispatch(self, frame: protocol.Frame):
+        """
+        Hands a frame from the brain to the command it replies to. A NACK which doesn't match a
+        command goes to every command not yet accepted, as a corrupted command may not have had
+        a readable sequence number.
+        """
+        if frame.type == protocol.HEARTBEAT:
+            self.on_heartbeat(frame.seq)
+            return
+        if frame.type == protocol.QUEUE_STATUS:
+            self.queue_status = protocol.decode_queue_status(frame)
+            return
+        if frame.type == protocol.MOTOR_STATE:
+            state = protocol.decode_motor_state(frame, time.perf_counter())
+            if state is not None:
+                self.motor_state = state
+            return
+
+        with self.pending_lock:
+            command = self.pending.get(frame.seq)
+            if command is not None:
+                self.telemetry.on_reply(command.timing, protocol.FRAME_OVERHEAD + len(frame.payload))
+                command.replies.put(frame)
+                return
+
+            if frame.type == protocol.NACK:
+                unaccepted = [c for c in self.pending.values() if not c.accepted]
+                for command in unaccepted:
+                    command.replies.put(frame)
+                if unaccepted:
+                    return
+
+        print(f"[Serial] Discarding unexpected frame: type {frame.type:#04x} seq {frame.seq}")
+
+
+    def on_heartbeat(self, seq: int):
+        if self.last_heartbeat_seq is not None:
+            self.missed_heartbeats += (seq - self.last_heartbeat_seq - 1) % protocol.SEQUENCE_MODULO
+        self.last_heartbeat_seq = seq
+
+
+    @property
+    def is_link_up(self) -> bool:
+        """
+        False once the brain hasn't been heard from for the link timeout, always True if the
+        brain doesn't send heartbeats.
+        """
+        return self.link_timeout is None or self.link_up.is_set()
+
+
+    def check_link(self):
+        """
+        Called by the reader thread after every read, marks the link down when the brain has gone
+        quiet and reopens the port every reconnect delay until it's heard from again.
+        """
+        if self.link_timeout is None or self.last_heard is None:
+            return
+
+        now = time.perf_counter()
+        silent = now - self.last_heard
+        if silent <= self.link_timeout:
+            if not self.link_up.is_set():
+                print("[Serial] Link to VEX brain restored")
+                self.link_up.set()
+            return
+
+        if self.link_up.is_set():
+            print(f"[Serial] Nothing heard from VEX brain for {silent:.2f}s, link down")
+            self.link_up.clear()
+            self.last_link_reconnect = None
+
+        if self.last_link_reconnect is None or now - self.last_link_reconnect >= self.reconnect_delay:
+            self.last_link_reconnect = now
+            # Reopening the port recovers a link which dropped on the PC side, i.e. the USB
+            # controller being unplugged and plugged back in
+            try:
+                self.reconnect()
+            except serial.SerialException:
+                pass
+            self.decoder = protocol.FrameDecoder()
+
+
+    def wait_for_link(self, timeout: float) -> bool:
+        """
+        Waits for the brain to be heard from, returns False if the link is still down after the timeout.
+        If the port can't be opened, i.e. the adapter is unplugged, it's retried every reconnect delay.
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                self.open()
+                break
+            except serial.SerialException as ex:
+                remaining = deadline - time.perf_counter()
+                print(f"[Serial] Opening {self.port} failed: {ex}")
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self.reconnect_delay, remaining))
+
+        return self.link_timeout is None or self.link_up.wait(max(0, deadline - time.perf_counter()))
+
+
+    def write(self, data: bytes, timing=None):
+        """Writes data to the port, timing is the command it's sent for if any, see SerialTelemetry.on_send."""
+        with self.write_lock:
+            try:
+                self.open()
+                self.serial.write(data)
+            except serial.SerialException:
+                self.reconnect()
+                self.serial.write(data)
+            self.telemetry.on_send(len(data), timing)
+
+
+    def next_seq(self) -> int:
+        self.seq = protocol.next_seq(self.seq)
+        return self.seq
+
+
+    def send_frame(self, frame_type: int, payload=b"") -> int:
+        """
+        Sends a frame without waiting for a reply, returns its sequence number.
+        """
+        seq = self.next_seq()
+        self.write(protocol.encode_frame(frame_type, seq, payload))
+        return seq
+
+
+    def wait_for_reply(self, command: PendingCommand, timeout: float):
+        """
+        Waits for the next reply to the command, see dispatch. Returns None if nothing arrives
+        within the timeout, or as soon as the link goes down.
+        """
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not self.is_link_up:
+                return None
+
+            try:
+                # Wakes up at least every read timeout to notice the link going down
+                return command.replies.get(timeout=min(remaining, config.SERIAL_READ_TIMEOUT))
+            except queue.Empty:
+                continue
+
+
+    def submit(self, frame_type: int, payload=b"", on_progress=None) -> PendingCommand:
+        """
+        Sends a command and waits for the brain to accept it, without waiting for it to be done.
+        Further commands can be submitted while it runs, the brain carries them out in order.
+        Blocks while config.SERIAL_PIPELINE_DEPTH commands are already in flight.
+
+        The brain must accept the command within config.SERIAL_ACK_TIMEOUT, if it's rejected or
+        not accepted in time it's resent up to config.SERIAL_COMMAND_RETRIES times. The brain
+        recognises a resent sequence number so the command is never carried out twice.
+
+        Parameters
+        ----------
+        frame_type: int
+            Command type, see protocol.py.
+        payload: bytes
+            Encoded command payload.
+        on_progress: callable
+            Optional, called with the index of each waypoint of a SEQUENCE command as it's reached.
+
+        Returns
+        -------
+        command: PendingCommand
+            Pass to wait_until_done, None if the command couldn't be sent, wasn't accepted or the link went down.
+        """
+        self.open()
+        self.pipeline.acquire()
+        command = None
+        try:
+            with self.submit_lock:
+                seq = self.next_seq()
+                data = protocol.encode_frame(frame_type, seq, payload)
+                command = PendingCommand(frame_type, seq, data, self.telemetry.start_command(frame_type, seq), on_progress)
+                with self.pending_lock:
+                    self.pending[seq] = command
+
+                reply = None
+                for attempt in range(config.SERIAL_COMMAND_RETRIES + 1):
+                    if not self.is_link_up:
+                        print(f"[Serial] Link down, giving up on command {seq}")
+                        break
+                    if attempt > 0:
+                        print(f"[Serial] Resending command {seq}, attempt {attempt + 1}")
+                    self.write(data, command.timing)
+
+                    reply = self.wait_for_reply(command, config.SERIAL_ACK_TIMEOUT)
+                    if reply is not None and reply.type != protocol.NACK:
+                        break
+                    if reply is not None:
+                        print(f"[Serial] Command {seq} rejected, status {protocol.decode_status(reply.payload)}")
+                        reply = None
+
+                if reply is None:
+                    self.last_accept_latency = None
+                    self.last_round_trip = None
+                    self.finish(command)
+                    return None
+
+                command.accepted = True
+                command.timing.accepted = time.perf_counter()
+                self.last_accept_latency = command.timing.accepted - command.start
+                # Anything after the ACCEPTED, i.e. the DONE of a command finishing straight away
+                if reply.type != protocol.ACK or protocol.decode_status(reply.payload) != protocol.ACCEPTED:
+                    command.replies.put(reply)
+                return command
+        except BaseException as ex:
+            # Give the pipeline slot back, otherwise every failed write would leave one less
+            if command is None:
+                self.pipeline.release()
+            else:
+                self.finish(command)
+            if not isinstance(ex, serial.SerialException):
+                raise
+            print(f"[Serial] Sending command failed: {ex}")
+            self.last_accept_latency = None
+            self.last_round_trip = None
+            return None
+
+
+    def wait_until_done(self, command: PendingCommand, timeout=20) -> bool:
+        """
+        Waits for a submitted command to be done, recording the round trip time in last_round_trip.
+        The command is resent every config.SERIAL_DONE_RESEND_INTERVAL without a DONE, so a lost
+        DONE is answered again rather than waiting out the timeout.
+
+        Parameters
+        ----------
+        command: PendingCommand
+            Returned by submit.
+        timeout: float
+            Seconds to wait for the command to be done, from when it was first sent.
+
+        Returns
+        -------
+        done: bool
+            True if the brain reported the command as done, False if it failed, timed out or the link went down.
+        """
+        try:
+            last_sent = time.perf_counter()
+            while True:
+                now = time.perf_counter()
+                remaining = timeout - (now - command.start)
+                if remaining <= 0 or not self.is_link_up:
+                    self.last_round_trip = None
+                    return False
+
+                resend_in = config.SERIAL_DONE_RESEND_INTERVAL - (now - last_sent)
+                if resend_in <= 0:
+                    last_sent = now
+                    try:
+                        self.write(command.data, command.timing)
+                    except serial.SerialException as ex:
+                        print(f"[Serial] Resending command {command.seq} failed: {ex}")
+                    continue
+
+                reply = self.wait_for_reply(command, min(remaining, resend_in))
+                if reply is None:
+                    continue
+
+                if reply.type == protocol.ACK and protocol.decode_status(reply.payload) == protocol.DONE:
+                    command.timing.done = time.perf_counter()
+                    self.last_round_trip = command.timing.done - command.start
+                    return True
+                if reply.type == protocol.ACK and protocol.decode_status(reply.payload) == protocol.FAILED:
+                    print(f"[Serial] Command {command.seq} failed, the arm didn't reach its position")
+                    self.last_round_trip = None
+                    return False
+                if reply.type == protocol.PROGRESS and command.on_progress is not None:
+                    command.on_progress(protocol.decode_progress(reply.payload))
+        finally:
+            self.finish(command)
+
+
+    def finish(self, command: PendingCommand):
+        with self.pending_lock:
+            if self.pending.pop(command.seq, None) is None:
+                return
+        self.pipeline.release()
+        self.telemetry.finish_command(command.timing)
+
+
+    def request(self, frame_type: int, payload=b"", timeout=20, on_progress=None) -> bool:
+        """
+        Sends a command and waits for the brain to carry it out, see submit and wait_until_done.
+        The command's timings are recorded in telemetry, see stats.
+
+        Returns
+        -------
+        done: bool
+            True if the brain reported the command as done, False if it wasn't accepted, failed, timed out
+            or the link went down.
+        """
+        command = self.submit(frame_type, payload, on_progress)
+        if command is None:
+            return False
+        return self.wait_until_done(command, timeout)
+
+
+    def move(self, base: float, shoulder: float, elbow: float, pickup: bool, timeout=20, direct=False,
+             profile=None) -> bool:
+        """
+        Moves the arm to the joint angles in degrees with the magnet on to pickup or off to drop.
+        The arm goes through the neutral pose unless direct, see protocol.FLAG_DIRECT, at the speed
+        profile's [velocity percent, acceleration percent per second], the brain's default if None.
+        Returns True once the move is done, False if it timed out.
+        """
+        payload = protocol.encode_move([base, shoulder, elbow], pickup, direct, profile)
+        return self.request(protocol.MOVE, payload, timeout)
+
+
+    def move_sequence(self, waypoints, timeout=20, on_progress=None) -> bool:
+        """
+        Moves the arm through the waypoints back to back in a single command, each a
+        protocol.Waypoint of joint angles in degrees, a magnet action and optionally a speed profile.
+        Returns True once the last waypoint is reached, False if it timed out.
+        """
+        return self.request(protocol.SEQUENCE, protocol.encode_sequence(waypoints), timeout, on_progress)
+
+
+    def alarm(self, message: str, timeout=20) -> bool:
+        """
+        Shows the message on the brain's screen and sounds the alarm until the next move.
+        """
+        payload = message.encode()[:protocol.MAX_PAYLOAD]
+        return self.request(protocol.ALARM, payload, timeout)
+
+
+    def measured_pose(self, max_age=config.SERIAL_MOTOR_STATE_MAX_AGE) -> list:
+        """
+        Base, shoulder and elbow degrees last measured by the brain, None if the brain hasn't
+        streamed its motor state within max_age seconds.
+        """
+        # Taken once so every field comes from the same state
+        state = self.motor_state
+        if state is None or time.perf_counter() - state.received > max_age:
+            return None
+        return list(state.positions)
+
+
+    def stats(self) -> dict:
+        """
+        Link timings and throughput, see serial_telemetry.SerialTelemetry.stats.
+        """
+        return self.telemetry.stats()
+
+
+# Connection shared by everything in the process using the module functions below
+connection = None
+connection_lock = threading.Lock()
+
+
+def get_connection() -> SerialConnection:
+    global connection
+    with connection_lock:
+        if connection is None:
+            connection = SerialConnection()
+        return connection
+
+
+def close():
+    global connection
+    with connection_lock:
+        if connection is not None:
+            connection.close()
+            connection = None
+
+
+def move(base: float, shoulder: float, elbow: float, pickup: bool, timeout=20, direct=False, profile=None) -> bool:
+    return get_connection().move(base, shoulder, elbow, pickup, timeout, direct, profile)
+
+
+def move_sequence(waypoints, timeout=20, on_progress=None) -> bool:
+    return get_connection().move_sequence(waypoints, timeout, on_progress)
+
+
+def alarm(message: str, timeout=20) -> bool:
+    return get_connection().alarm(message, timeout)
+
+
+def measured_pose(max_age=config.SERIAL_MOTOR_STATE_MAX_AGE) -> list:
+    return get_connection().measured_pose(max_age)
+
+
+def stats() -> dict:
+    return get_connection().stats()
@@ -0,0 +1,229 @@
+import csv, json, threading, time
+from collections import deque
+import numpy as np
+import config
+
+# Per command timings kept in the CSV and JSON dumps, durations are in milliseconds from sending
+COMMAND_FIELDS = ["sent_at", "type", "seq", "attempts", "done", "first_byte_ms", "accept_ms",
+                  "execution_ms", "round_trip_ms", "bytes_sent", "bytes_received"]
+
+# Phases of a command histograms are kept for
+PHASES = ["first_byte_ms", "accept_ms", "execution_ms", "round_trip_ms"]
+
+
+class CommandTiming():
+    """
+    Timestamps of a single command, perf_counter seconds.
+
+    send: command about to be written to the port for the first time
+    first_byte: first reply to the command received from the brain
+    accepted: brain's ACCEPTED reply received, the command has made it across the link
+    done: brain's DONE reply received, the command has been carried out
+    """
+    def __init__(self, frame_type: int, seq: int):
+        self.frame_type = frame_type
+        self.seq = seq
+        self.sent_at = time.time()
+        # Taken before writing so a reply can never arrive before it
+        self.send = time.perf_counter()
+        self.first_byte = None
+        self.accepted = None
+        self.done = None
+        self.attempts = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+    def as_row(self) -> dict:
+        def since_send(timestamp):
+            if timestamp is None:
+                return None
+            return (timestamp - self.send) * 1000
+
+        return {
+            "sent_at": self.sent_at,
+            "type": self.frame_type,
+            "seq": self.seq,
+            "attempts": self.attempts,
+            "done": self.done is not None,
+            "first_byte_ms": since_send(self.first_byte),
+            "accept_ms": since_send(self.accepted),
+            "execution_ms": (self.done - self.accepted) * 1000 if self.done is not None and self.accepted is not None else None,
+            "round_trip_ms": since_send(self.done),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received
+        }
+
+
+class SerialTelemetry():
+    """
+    Timings and throughput of the serial link to the VEX brain. The connection records every
+    command's send, first reply, ACCEPTED and DONE times, and every byte sent and received.
+    Only the frames sent for and replying to a command count towards it, heartbeats and motor
+    state only count towards the link's throughput.
+
+    Each phase of a command is kept over the last `history` commands for the histograms, bytes
+    and commands per second are measured over the last `window` seconds. If a dump path is given
+    the stats are written to it every `dump_interval` seconds, as CSV if the path ends in .csv
+    otherwise JSON.
+    """
+    def __init__(self, history=config.SERIAL_TELEMETRY_HISTORY, window=config.SERIAL_TELEMETRY_WINDOW,
+                 bins_ms=config.SERIAL_TELEMETRY_BINS_MS, dump_path=config.SERIAL_TELEMETRY_DUMP_PATH,
+                 dump_interval=config.SERIAL_TELEMETRY_DUMP_INTERVAL):
+        self.window = window
+        self.bins_ms = list(bins_ms)
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.last_dump = time.perf_counter()
+
+        # The reader thread records received bytes and replies while the request threads record everything else
+        self.lock = threading.Lock()
+        self.commands = deque(maxlen=history)
+
+        # (perf_counter, bytes) of traffic and (perf_counter, 1) of completed commands within the window
+        self.sent_events = deque()
+        self.received_events = deque()
+        self.completed_events = deque()
+
+        self.total_commands = 0
+        self.total_timeouts = 0
+        self.total_resends = 0
+        self.total_bytes_sent = 0
+        self.total_bytes_received = 0
+
+
+    def start_command(self, frame_type: int, seq: int) -> CommandTiming:
+        return CommandTiming(frame_type, seq)
+
+
+    def on_send(self, size: int, timing: CommandTiming = None):
+        """Records bytes written to the port, timing is the command they were sent for if any."""
+        now = time.perf_counter()
+        with self.lock:
+            self.total_bytes_sent += size
+            self.sent_events.append((now, size))
+            self.trim(self.sent_events, now)
+
+            if timing is not None:
+                if timing.attempts > 0:
+                    self.total_resends += 1
+                timing.attempts += 1
+                timing.bytes_sent += size
+
+
+    def on_receive(self, size: int):
+        """Records bytes read from the port, whatever they turn out to be."""
+        now = time.perf_counter()
+        with self.lock:
+            self.total_bytes_received += size
+            self.received_events.append((now, size))
+            self.trim(self.received_events, now)
+        self.check_dump()
+
+
+    def on_reply(self, timing: CommandTiming, size: int):
+        """Records a frame of size bytes replying to the command."""
+        now = time.perf_counter()
+        with self.lock:
+            if timing.first_byte is None:
+                timing.first_byte = now
+            timing.bytes_received += size
+
+
+    def finish_command(self, timing: CommandTiming):
+        now = time.perf_counter()
+        with self.lock:
+            self.commands.append(timing.as_row())
+            self.total_commands += 1
+            if timing.done is None:
+                self.total_timeouts += 1
+            else:
+                self.completed_events.append((now, 1))
+            self.trim(self.completed_events, now)
+        self.check_dump()
+
+
+    def check_dump(self):
+        """
+        Dumps the stats if the dump interval has passed since the last dump. Called as bytes arrive
+        and commands finish, and by the connection while the link is idle.
+        """
+        if self.dump_path is None:
+            return
+
+        now = time.perf_counter()
+        with self.lock:
+            if now - self.last_dump < self.dump_interval:
+                return
+            self.last_dump = now
+
+        try:
+            self.dump(self.dump_path)
+        except OSError as ex:
+            print(f"[Telemetry] Could not write {self.dump_path}: {ex}")
+
+
+    def trim(self, events, now):
+        while events and now - events[0][0] > self.window:
+            events.popleft()
+
+
+    def stats(self) -> dict:
+        """
+        Totals, throughput over the window and the distribution of each phase over the history.
+        Durations are in milliseconds, histograms count the commands in each bin of bins_ms.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            for events in (self.sent_events, self.received_events, self.completed_events):
+                self.trim(events, now)
+            commands = list(self.commands)
+
+            stats = {
+                "commands": self.total_commands,
+                "timeouts": self.total_timeouts,
+                "resends": self.total_resends,
+                "bytes_sent": self.total_bytes_sent,
+                "bytes_received": self.total_bytes_received,
+                "window_seconds": self.window,
+                "commands_per_second": len(self.completed_events) / self.window,
+                "bytes_sent_per_second": sum(size for _, size in self.sent_events) / self.window,
+                "bytes_received_per_second": sum(size for _, size in self.received_events) / self.window,
+                "bins_ms": self.bins_ms
+            }
+
+        for phase in PHASES:
+            durations = np.array([c[phase] for c in commands if c[phase] is not None], dtype=np.float64)
+            if len(durations) == 0:
+                stats[phase] = None
+                continue
+
+            counts, _ = np.histogram(durations, self.bins_ms)
+            stats[phase] = {
+                "count": len(durations),
+                "mean": float(durations.mean()),
+                "p50": float(np.percentile(durations, 50)),
+                "p90": float(np.percentile(durations, 90)),
+                "p99": float(np.percentile(durations, 99)),
+                "max": float(durations.max()),
+                "histogram": counts.tolist()
+            }
+        return stats
+
+
+    def dump(self, path: str):
+        """
+        Writes the per command timings in the history to a CSV file, or them and the stats to a
+        JSON file.
+        """
+        with self.lock:
+            commands = list(self.commands)
+
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=COMMAND_FIELDS)
+                writer.writeheader()
+                writer.writerows(commands)
+        else:
+            with open(path, "w") as f:
+                json.dump({"stats": self.stats(), "commands": commands}, f, indent=2)
@@ -10,15 +10,102 @@
 
 # Library imports
 from vex import *
+import struct
 
 # Initialise Constants
 SHOULDER_GEAR_RATIO = 2.5
 DEFAULT_VELOCITY = 5
+# Move the joints at the same time, with their velocities scaled to arrive together, rather
+# than one after the other
+CONCURRENT_MOTION = True
+# Milliseconds between checks for the joints finishing a concurrent move
+MOTION_POLL_INTERVAL = 10
+# Lowest velocity percent a move ramps up from when accelerating, and the lowest any joint is
+# scaled down to so one with a tiny move doesn't crawl
+MIN_VELOCITY = 1
+# Motor degrees per second at 100% velocity, a little under the EXP motor's free speed so move
+# timeouts err on the long side
+MOTOR_DEGREES_PER_SECOND = 600
+# A move is given up on after this many times its expected duration plus MOVE_TIMEOUT_MARGIN
+# milliseconds, so a stalled joint can't hold up the executor forever
+MOVE_TIMEOUT_FACTOR = 3
+MOVE_TIMEOUT_MARGIN = 2000
+# Motor degrees from a pass through position at which the next move starts, blending the two
+BLEND_TOLERANCE = 5
+
+# Moves waiting to be carried out, commands arriving once it's full are rejected
+QUEUE_CAPACITY = 8
+# Number of finished commands remembered so a resend of one isn't carried out again
+DONE_HISTORY = 16
 
 SERIAL_PORT = "/dev/serial1"
 # Mode is read and write in binary
 SERIAL_MODE = "rwb"
 
+# Framed binary protocol, must match controller/protocol.py
+# | sync (2) | type (1) | sequence (2) | payload length (1) | payload (0-255) | CRC-16 (2) |
+SYNC = b"\xa5\x5a"
+HEADER_FORMAT = "<BHB"
+HEADER_SIZE = 4
+CRC_FORMAT = "<H"
+CRC_SIZE = 2
+
+# Command types
+MOVE = 0x01
+ALARM = 0x02
+SEQUENCE = 0x03
+# Reply types
+ACK = 0x80
+NACK = 0x81
+PROGRESS = 0x82
+HEARTBEAT = 0x83
+QUEUE_STATUS = 0x84
+MOTOR_STATE = 0x85
+# ACK statuses
+ACCEPTED = 0
+DONE = 1
+FAILED = 2
+# NACK statuses
+BAD_CRC = 1
+UNKNOWN_TYPE = 2
+BAD_PAYLOAD = 3
+QUEUE_FULL = 4
+
+# Base, shoulder and elbow degrees, flags, then the speed profile's velocity percent and
+# acceleration percent per second. A velocity of 0 is the default velocity, an acceleration of 0
+# starts at full velocity
+MOVE_FORMAT = "<fffBBB"
+MOVE_SIZE = 15
+FLAG_PICKUP = 0x01
+# Skip the neutral position, the controller has checked the direct path is clear of the floor
+FLAG_DIRECT = 0x02
+
+# Number of waypoints then each waypoint's base, shoulder and elbow degrees, magnet action and
+# speed profile as a move
+WAYPOINT_FORMAT = "<fffBBB"
+WAYPOINT_SIZE = 15
+MAX_PAYLOAD = 255
+MAX_WAYPOINTS = (MAX_PAYLOAD - 1) // WAYPOINT_SIZE
+# Longest payload of each command, a frame claiming to be longer must have a corrupted header
+MAX_PAYLOAD_SIZES = {MOVE: MOVE_SIZE, SEQUENCE: 1 + MAX_WAYPOINTS * WAYPOINT_SIZE}
+ACTION_NONE = 0
+ACTION_PICKUP = 1
+ACTION_DROP = 2
+# Set in the action byte to skip the neutral position, as FLAG_DIRECT
+WAYPOINT_DIRECT = 0x80
+
+# Milliseconds between alarm sounds while an alarm is showing
+ALARM_SOUND_INTERVAL = 1000
+
+# Milliseconds between heartbeats, must match SERIAL_HEARTBEAT_INTERVAL in controller/config.py
+HEARTBEAT_INTERVAL = 100
+
+# Brain timer milliseconds, then base, shoulder and elbow degrees, degrees per second and amps,
+# then 1 if the magnet is holding
+MOTOR_STATE_FORMAT = "<I3f3f3fB"
+# Milliseconds between motor states, must match SERIAL_MOTOR_STATE_INTERVAL in controller/config.py
+MOTOR_STATE_INTERVAL = 50
+
 # Initialise VEX Arm Components
 brain = Brain()
 base = Motor(Ports.PORT1, True)
@@ -38,29 +125,108 @@ def handle_exception(ex):
     print(ex)
 
 
-def move(angles):
-    # Move to neutral position
-    shoulder.spin_to_position(90 * SHOULDER_GEAR_RATIO, DEGREES)
-    elbow.spin_to_position(0, DEGREES)
+def spin_motors(motors, positions, distances, velocity):
+    # The motor with furthest to go at the velocity and the rest proportionally slower
+    furthest = max(distances)
+    for i in range(len(motors)):
+        if distances[i] > 0:
+            motors[i].spin_to_position(positions[i], DEGREES, max(MIN_VELOCITY, velocity * distances[i] / furthest), PERCENT, False)
+
+def motors_arrived(motors, positions, blend):
+    for i in range(len(motors)):
+        if motors[i].is_done():
+            continue
+        if not blend or abs(motors[i].position(DEGREES) - positions[i]) > BLEND_TOLERANCE:
+            return False
+    return True
+
+def move_together(motors, positions, velocity=DEFAULT_VELOCITY, acceleration=0, blend=False):
+    # Starts every motor towards its position in motor degrees so they all arrive together, then
+    # waits for all of them. With an acceleration the velocity ramps up from MIN_VELOCITY. When
+    # blending it returns once they're all within BLEND_TOLERANCE so the next move starts
+    # without the arm stopping. If they haven't arrived by the move timeout they're stopped, an
+    # alarm is raised and it returns False
+    distances = [abs(positions[i] - motors[i].position(DEGREES)) for i in range(len(motors))]
+    if max(distances) == 0:
+        return True
+
+    start = brain.timer.time(MSEC)
+    expected = max(distances) * 100 / (velocity * MOTOR_DEGREES_PER_SECOND) * 1000
+    if acceleration > 0:
+        expected += velocity / acceleration * 1000
+    timeout = expected * MOVE_TIMEOUT_FACTOR + MOVE_TIMEOUT_MARGIN
+    current_velocity = velocity
+    if acceleration > 0:
+        current_velocity = min(velocity, MIN_VELOCITY)
+    spin_motors(motors, positions, distances, current_velocity)
+
+    while not motors_arrived(motors, positions, blend):
+        if brain.timer.time(MSEC) - start > timeout:
+            for motor in motors:
+                motor.stop()
+            set_alarm(["Move timed out"])
+            return False
+        wait(MOTION_POLL_INTERVAL, MSEC)
+
+        if current_velocity < velocity:
+            # Resending the target with a higher velocity speeds up the move in progress
+            elapsed = (brain.timer.time(MSEC) - start) / 1000
+            current_velocity = min(velocity, max(MIN_VELOCITY, acceleration * elapsed))
+            spin_motors(motors, positions, distances, current_velocity)
+    return True
+
+def move(angles, direct=False, velocity=0, acceleration=0, blend=False):
+    # Returns False as soon as a part of the move times out, the rest isn't attempted
+    if velocity == 0:
+        velocity = DEFAULT_VELOCITY
 
-    # Move to target position
-    base.spin_to_position(angles[0], DEGREES, wait=True)
-    elbow.spin_to_position(angles[2], DEGREES, wait=True)
-    shoulder.spin_to_position(angles[1] * SHOULDER_GEAR_RATIO, DEGREES, wait=True)
+    if direct:
+        # Straight to the target position with all joints at once
+        return move_together([base, shoulder, elbow], [angles[0], angles[1] * SHOULDER_GEAR_RATIO, angles[2]], velocity, acceleration, blend)
 
+    if CONCURRENT_MOTION:
+        # Move to neutral position then to target position, all joints at once in both. The
+        # neutral position is only passed through so it's always blended
+        return (move_together([shoulder, elbow], [90 * SHOULDER_GEAR_RATIO, 0], velocity, acceleration, True)
+                and move_together([base, shoulder, elbow], [angles[0], angles[1] * SHOULDER_GEAR_RATIO, angles[2]], velocity, acceleration, blend))
 
-def pickup_move(angles):
+    # Move to neutral position, then to target position
+    return (move_together([shoulder], [90 * SHOULDER_GEAR_RATIO], velocity, acceleration)
+            and move_together([elbow], [0], velocity, acceleration)
+            and move_together([base], [angles[0]], velocity, acceleration)
+            and move_together([elbow], [angles[2]], velocity, acceleration)
+            and move_together([shoulder], [angles[1] * SHOULDER_GEAR_RATIO], velocity, acceleration, blend))
+
+
+def pickup_move(angles, direct=False, velocity=0, acceleration=0):
+    global magnet_on
     magnet.set_power(100)
     magnet.pickup()
+    magnet_on = True
 
-    move(angles) 
+    return move(angles, direct, velocity, acceleration)
 
    
-def drop_move(angles):
-    move(angles)
+def drop_move(angles, direct=False, velocity=0, acceleration=0):
+    global magnet_on
+    # Only dropped once it's where it should be
+    if not move(angles, direct, velocity, acceleration):
+        return False
 
     magnet.set_power(100)
     magnet.drop()
+    magnet_on = False
+    return True
+
+
+def waypoint_move(angles, action, direct=False, velocity=0, acceleration=0, blend=False):
+    # Returns False if the arm didn't reach the position
+    if action == ACTION_PICKUP:
+        return pickup_move(angles, direct, velocity, acceleration)
+    if action == ACTION_DROP:
+        return drop_move(angles, direct, velocity, acceleration)
+    # Only positions without a magnet action are passed through, the rest must be reached
+    return move(angles, direct, velocity, acceleration, blend)
 
 
 def print_message_to_screen(message):
@@ -71,67 +237,309 @@ def print_message_to_screen(message):
         brain.screen.set_cursor(i + 1, 1)
         brain.screen.print(message[i])
 
-def send_serial_message():
-    pass
+def build_crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+CRC_TABLE = build_crc_table()
+
+def crc16(data):
+    # CRC-16/CCITT-FALSE, table driven to keep the brain's per byte work low
+    crc = 0xFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[((crc >> 8) ^ byte) & 0xFF]
+    return crc
+
+# Bytes read_frame has put back to be scanned again, read before anything new from the port
+unread = b""
+
+def read_exactly(serial, size):
+    global unread
+    data = unread[:size]
+    unread = unread[size:]
+    while len(data) < size:
+        chunk = serial.read(size - len(data))
+        if chunk:
+            data += chunk
+    return data
+
+def read_frame(serial):
+    # Blocks until a frame arrives, payload is None if the frame is corrupted. Only the sync of a
+    # corrupted frame is skipped, the rest is scanned again as the next frame may start inside it
+    global unread
+    matched = 0
+    while matched < len(SYNC):
+        byte = read_exactly(serial, 1)[0]
+        if byte == SYNC[matched]:
+            matched += 1
+        elif byte == SYNC[0]:
+            matched = 1
+        else:
+            matched = 0
+
+    header = read_exactly(serial, HEADER_SIZE)
+    frame_type, seq, length = struct.unpack(HEADER_FORMAT, header)
+    if length > MAX_PAYLOAD_SIZES.get(frame_type, MAX_PAYLOAD):
+        unread = header + unread
+        return frame_type, seq, None
+
+    payload = read_exactly(serial, length)
+    crc_bytes = read_exactly(serial, CRC_SIZE)
+    crc = struct.unpack(CRC_FORMAT, crc_bytes)[0]
+
+    if crc != crc16(header + payload):
+        unread = header + payload + crc_bytes + unread
+        return frame_type, seq, None
+    return frame_type, seq, payload
+
+def send_frame(serial, frame_type, seq, payload=b""):
+    body = struct.pack(HEADER_FORMAT, frame_type, seq, len(payload)) + payload
+    serial.write(SYNC + body + struct.pack(CRC_FORMAT, crc16(body)))
+
+def send_ack(serial, seq, status):
+    send_frame(serial, ACK, seq, bytes([status]))
+
+def send_nack(serial, seq, status):
+    send_frame(serial, NACK, seq, bytes([status]))
+
+def decode_waypoints(payload):
+    # Returns None if the payload is malformed
+    if len(payload) < 1 or len(payload) != 1 + payload[0] * WAYPOINT_SIZE:
+        return None
+
+    waypoints = []
+    for i in range(payload[0]):
+        offset = 1 + i * WAYPOINT_SIZE
+        base_angle, shoulder_angle, elbow_angle, action, velocity, acceleration = struct.unpack(
+            WAYPOINT_FORMAT, payload[offset:offset + WAYPOINT_SIZE])
+        waypoints.append(([base_angle, shoulder_angle, elbow_angle], action & ~WAYPOINT_DIRECT, bool(action & WAYPOINT_DIRECT),
+                          velocity, acceleration))
+    return waypoints
 
-aThread = None
 alarm_running = False
 alarm_message = None
+# Counts alarm changes so a handler for an older alarm stops sounding it
+alarm_generation = 0
+last_alarm_sound = None
+# Broadcast by set_alarm and clear_alarm, each broadcast runs on_alarm_changed in its own thread
+alarm_changed = Event()
+# Opened by serial_monitor, shared with heartbeat_monitor and motor_state_monitor
+serial_port = None
+# The electromagnet has no state to read back, so the last pickup or drop is remembered
+magnet_on = False
+
+def set_alarm(message):
+    global alarm_running, alarm_message, alarm_generation
+    if alarm_running and alarm_message == message:
+        return
+    alarm_running = True
+    alarm_message = message
+    alarm_generation += 1
+    alarm_changed.broadcast()
+
+def clear_alarm():
+    global alarm_running, alarm_message, alarm_generation
+    if not alarm_running:
+        return
+    alarm_running = False
+    alarm_message = None
+    alarm_generation += 1
+    alarm_changed.broadcast()
+
+def on_alarm_changed():
+    # Draws the alarm once, then sounds it every ALARM_SOUND_INTERVAL until it changes. Nothing
+    # runs while there's no alarm so the brain's time goes to the serial and motion threads
+    global last_alarm_sound
+    generation = alarm_generation
+    if not alarm_running:
+        # Cleared by the next move, which draws its own screen
+        return
+
+    print_message_to_screen(alarm_message)
+    while alarm_running and generation == alarm_generation:
+        now = brain.timer.time(MSEC)
+        if last_alarm_sound is None or now - last_alarm_sound >= ALARM_SOUND_INTERVAL:
+            last_alarm_sound = now
+            brain.play_sound(SoundType.ALARM)
+        wait(ALARM_SOUND_INTERVAL - (now - last_alarm_sound), MSEC)
+
+alarm_changed(on_alarm_changed)
 
-def alarm_monitor():
-    global alarm_running, alarm_message
-    while alarm_running:
-        print_message_to_screen(alarm_message)
-        brain.play_sound(SoundType.ALARM)
-        wait(100, MSEC)
+def heartbeat_monitor():
+    # Sent whether or not a command is being carried out so the controller can tell the link is alive
+    beat = 0
+    while True:
+        if serial_port is not None:
+            send_frame(serial_port, HEARTBEAT, beat)
+            beat = (beat + 1) % 65536
+        wait(HEARTBEAT_INTERVAL, MSEC)
+
+def motor_state_monitor():
+    # Streams the measured pose so the controller knows where the arm really is, even mid move
+    sample = 0
+    joints = [base, shoulder, elbow]
+    # Motor degrees to joint degrees
+    ratios = [1, SHOULDER_GEAR_RATIO, 1]
+    while True:
+        if serial_port is not None:
+            positions = [joints[i].position(DEGREES) / ratios[i] for i in range(3)]
+            velocities = [joints[i].velocity(VelocityUnits.DPS) / ratios[i] for i in range(3)]
+            currents = [joint.current(CurrentUnits.AMP) for joint in joints]
+            payload = struct.pack(MOTOR_STATE_FORMAT, int(brain.timer.time(MSEC)) & 0xFFFFFFFF,
+                                  positions[0], positions[1], positions[2],
+                                  velocities[0], velocities[1], velocities[2],
+                                  currents[0], currents[1], currents[2], 1 if magnet_on else 0)
+            send_frame(serial_port, MOTOR_STATE, sample, payload)
+            sample = (sample + 1) % 65536
+        wait(MOTOR_STATE_INTERVAL, MSEC)
+
+# Commands waiting to be carried out as (seq, is_sequence, waypoints), oldest first. Threads are
+# cooperative so the list is only changed between waits
+command_queue = []
+# Sequence number of the command being carried out, None when idle
+executing_seq = None
+# (seq, status) of the last DONE_HISTORY commands finished, status is DONE or FAILED
+done_seqs = []
+
+def send_queue_status(serial):
+    seq = executing_seq if executing_seq is not None else 0
+    send_frame(serial, QUEUE_STATUS, seq, bytes([len(command_queue), QUEUE_CAPACITY]))
+
+def remember_done(seq, status=DONE):
+    done_seqs.append((seq, status))
+    if len(done_seqs) > DONE_HISTORY:
+        done_seqs.pop(0)
+
+def done_status(seq):
+    # DONE or FAILED if the command has finished, None if it hasn't
+    for done_seq, status in done_seqs:
+        if done_seq == seq:
+            return status
+    return None
+
+def decode_move(payload):
+    # MOVE as a single waypoint list, None if the payload is malformed
+    if len(payload) != MOVE_SIZE:
+        return None
+
+    base_angle, shoulder_angle, elbow_angle, flags, velocity, acceleration = struct.unpack(MOVE_FORMAT, payload)
+    action = ACTION_PICKUP if flags & FLAG_PICKUP else ACTION_DROP
+    return [([base_angle, shoulder_angle, elbow_angle], action, bool(flags & FLAG_DIRECT), velocity, acceleration)]
+
+def command_executor():
+    # Carries out queued commands in order. A position without a magnet action is blended into
+    # the next one when it's already known, from the same sequence or the next queued command
+    global executing_seq
+
+    while True:
+        if len(command_queue) == 0 or serial_port is None:
+            wait(MOTION_POLL_INTERVAL, MSEC)
+            continue
+
+        seq, is_sequence, waypoints = command_queue.pop(0)
+        executing_seq = seq
+        send_queue_status(serial_port)
+        clear_alarm()
+
+        # Run the waypoints back to back, reporting each one as it's reached
+        is_done = True
+        for i in range(len(waypoints)):
+            joint_angles, action, is_direct, velocity, acceleration = waypoints[i]
+
+            brain.screen.clear_screen()
+            brain.screen.set_cursor(1, 1)
+            brain.screen.print("Waypoint", i + 1, "of", len(waypoints))
+            brain.screen.set_cursor(2,1)
+            brain.screen.print(joint_angles)
+
+            blend = i + 1 < len(waypoints) or len(command_queue) > 0
+            if not waypoint_move(joint_angles, action, is_direct, velocity, acceleration, blend):
+                is_done = False
+                break
+            if is_sequence:
+                send_frame(serial_port, PROGRESS, seq, bytes([i]))
+
+        if is_done:
+            remember_done(seq)
+            executing_seq = None
+            send_ack(serial_port, seq, DONE)
+        else:
+            # The arm stopped short, the queued commands were planned from where it should have
+            # been so they fail along with this one
+            failed_seqs = [seq]
+            while len(command_queue) > 0:
+                failed_seqs.append(command_queue.pop(0)[0])
+            executing_seq = None
+            for failed_seq in failed_seqs:
+                remember_done(failed_seq, FAILED)
+                send_ack(serial_port, failed_seq, FAILED)
+        send_queue_status(serial_port)
 
 def serial_monitor():
+    # Reads commands as they arrive, even while the arm is moving, and queues moves for the executor
+    global serial_port
     try:
       serial = open(SERIAL_PORT, SERIAL_MODE)
     except:
       raise Exception("Serial port not available")
-  
-    global alarm_running
-    global alarm_message
+    serial_port = serial
 
     while True:
-        data = serial.readline()
-        
-        if data == None:
+        frame_type, seq, payload = read_frame(serial)
+
+        if payload is None:
+            send_nack(serial, seq, BAD_CRC)
+            continue
+
+        # The controller resent a command it already sent, the reply must have been lost
+        status = done_status(seq)
+        if status is not None:
+            send_ack(serial, seq, ACCEPTED)
+            send_ack(serial, seq, status)
+            continue
+        if seq == executing_seq or any(command[0] == seq for command in command_queue):
+            send_ack(serial, seq, ACCEPTED)
             continue
-        
-        data_array = data.split()
-
-        # Length 1 = Error message
-        # Otherwise the message is normal
-        if len(data_array) == 1:
-            alarm_running = True
-            alarm_message = data_array
+
+        if frame_type == ALARM:
+            send_ack(serial, seq, ACCEPTED)
+            set_alarm([payload])
+            remember_done(seq)
+            send_ack(serial, seq, DONE)
+            continue
+
+        if frame_type == MOVE:
+            waypoints = decode_move(payload)
+        elif frame_type == SEQUENCE:
+            waypoints = decode_waypoints(payload)
         else:
-            alarm_running = False
-            alarm_message = None
-            joint_angles = []
-            for angle in data_array[:3]:
-                joint_angles.append(float(angle))
-            
-            is_pickup = data_array[3]
-            
-            brain.screen.clear_screen()
-            brain.screen.set_cursor(1, 1)
-            brain.screen.print(is_pickup)
-            brain.screen.set_cursor(2,1)
-            brain.screen.print(joint_angles)
-            
-            if is_pickup == b'True':
-                pickup_move(joint_angles)
-            else:
-                drop_move(joint_angles)
+            send_nack(serial, seq, UNKNOWN_TYPE)
+            continue
+
+        if waypoints is None:
+            send_nack(serial, seq, BAD_PAYLOAD)
+            continue
+        if len(command_queue) >= QUEUE_CAPACITY:
+            send_nack(serial, seq, QUEUE_FULL)
+            continue
 
-        serial.write("Done".encode())
+        command_queue.append((seq, frame_type == SEQUENCE, waypoints))
+        send_ack(serial, seq, ACCEPTED)
+        send_queue_status(serial)
 
 
 try:
-    alarm_thread=Thread(alarm_monitor)
     t1=Thread(serial_monitor)
+    executor_thread=Thread(command_executor)
+    heartbeat_thread=Thread(heartbeat_monitor)
+    motor_state_thread=Thread(motor_state_monitor)
 except Exception as ex:
     handle_exception(ex)
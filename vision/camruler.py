@@ -4,7 +4,7 @@
 # Author: duder1966
 # -------------------------------------------------------------
 
-import os,sys,time,traceback
+import os,sys,time,traceback,socket,struct,errno
 from math import hypot
 import numpy as np
 import cv2
@@ -20,12 +20,40 @@ object_log = []
 log_interval = 1  # seconds
 last_log_time = time.time()
 log_file = "object_log.csv"
+# Also write detections to log_file every log_interval, the master only reads it if its OBJECT_SOURCE is "csv"
+log_to_csv = True
 iteration = 0
 
 # Delete contents of log_file
-if os.path.exists(log_file):
+if log_to_csv and os.path.exists(log_file):
     open(log_file, 'w').close()
 
+# --- Detection channel ---
+# Every frame's detections are sent to the master as a single datagram, must match
+# controller/detection_channel.py and DETECTION_CHANNEL_HOST and _PORT in controller/config.py
+# | magic (4) | iteration (4) | capture ns (8) | publish ns (8) | object count (2) | objects |
+detection_channel = ("127.0.0.1", 5005)
+detection_magic = b"DET1"
+detection_header = struct.Struct("<4sIqqH")
+detection_object = struct.Struct("<5f")
+detection_max_objects = (65507 - detection_header.size) // detection_object.size
+detection_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+def publish_detections(iteration, capture_ns, objects):
+    # objects are a single frame's detections, anything past what fits in a datagram is dropped
+    if len(objects) > detection_max_objects:
+        print(f"[DETECTIONS] {len(objects)} objects in frame {iteration}, only publishing the first {detection_max_objects}")
+        objects = objects[:detection_max_objects]
+
+    data = detection_header.pack(detection_magic, iteration % (1 << 32), capture_ns, time.time_ns(), len(objects))
+    data += b"".join(detection_object.pack(o["mid_x"], o["mid_y"], o["width"], o["height"], o["area"]) for o in objects)
+    try:
+        detection_socket.sendto(data, detection_channel)
+    except OSError as ex:
+        # Nothing is listening yet, the master gets the next frame's detections once it starts
+        if ex.errno != errno.ECONNREFUSED:
+            print(f"[DETECTIONS] Publishing frame {iteration} failed: {ex}")
+
 # Config fallbacks
 camera_id = 1
 camera_width = 1920
@@ -365,6 +393,10 @@ while 1:
     if frame0 is None:
         time.sleep(0.1)
         continue
+    # The camera thread doesn't timestamp frames, so this is as close to capture as there is
+    capture_ns = time.time_ns()
+    # This frame's detections, published on their own and added to object_log for the CSV
+    frame_objects = []
 
     # normalize
     cv2.normalize(frame0,frame0,norm_alpha,norm_beta,cv2.NORM_MINMAX)
@@ -530,7 +562,7 @@ while 1:
             carea = xlen*ylen
 
             # log object data
-            object_log.append({
+            frame_objects.append({
                 "timestamp": datetime.now().astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f%z"),
                 "iteration": iteration,
                 "mid_x": round(x3c, 2),
@@ -620,8 +652,13 @@ while 1:
                 draw.add_text(frame0,f'{ylen:.2f}',x1-4,(y1+y2)/2,middle=True,right=True,color='red')
                 draw.add_text(frame0,f'{llen:.2f}',x2+8,y2-4,color='green')
     
+    # publish every frame's detections, including none, as soon as they're found
+    object_log.extend(frame_objects)
+    if key_flags['auto']:
+        publish_detections(iteration, capture_ns, frame_objects)
+
     # check if it's time to write the log
-    if time.time() - last_log_time > log_interval and object_log:
+    if log_to_csv and time.time() - last_log_time > log_interval and object_log:
         write_header = not os.path.exists(log_file)
 
         with open(log_file, 'w', newline='') as f:
@@ -632,6 +669,9 @@ while 1:
         print(f"[LOG] Wrote {len(object_log)} objects to {log_file}")
         object_log.clear()
         last_log_time = time.time()
+
+    # each processed frame is its own iteration
+    if key_flags['auto']:
         iteration += 1
 
     # add usage key